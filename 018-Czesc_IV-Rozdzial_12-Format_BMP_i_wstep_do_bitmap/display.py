@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Wyświetlanie bitmap w oknie pygame. Zamiast kopiować piksele pojedynczo
+# przez pygame.PixelArray, bufor z bitmapą jest opakowywany w powierzchnię
+# (pygame.image.frombuffer) i kopiowany do okna jedną operacją blit. Jedyną
+# operacją na poszczególnych bajtach jest zamiana kolejności kanałów, która
+# odbywa się naraz dla całego bufora (patrz procedural.swizzle).
+#
+# Działa również bez ekranu, ze sterownikiem SDL_VIDEODRIVER=dummy.
+import array
+import os
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import pygame
+from pygame.locals import *
+
+from procedural import swizzle
+
+
+def swap_rb(data, bpp=3):
+  # Zwraca kopię pikseli (bytearray) z zamienionymi kanałami R i B, czyli
+  # konwersję BGR <-> RGB (lub BGRX <-> RGBX dla bpp równego 4).
+  order = "BGRX"[:bpp]
+  return swizzle(data, order, "RGB" + order[3:])
+
+def blit_rgb24(surface, data, w, h, dest):
+  # Bitmapa 24-bitowa w kolejności RGB (np. wynik funkcji z procedural).
+  # Powierzchnia korzysta bezpośrednio z bufora data, bez kopiowania.
+  image = pygame.image.frombuffer(buffer(data), (w, h), "RGB")
+  surface.blit(image, dest)
+
+def blit_bgr24(surface, data, w, h, dest):
+  # Bitmapa 24-bitowa w kolejności BGR (np. wynik MyLoadBMP).
+  image = pygame.image.frombuffer(swap_rb(data), (w, h), "RGB")
+  surface.blit(image, dest)
+
+def blit_rgb32(surface, data, w, h, dest):
+  # Bitmapa w tablicy array z pikselami jako liczbami 0x00BBGGRR (R w
+  # najmłodszym bajcie; zakładam, że liczby są zapisane little-endian).
+  # Elementy tablicy mogą być dłuższe niż 4 bajty (np. 'L' na 64-bitowym
+  # Linuksie) - wtedy z każdego brane są tylko 4 najmłodsze bajty.
+  pixels = bytearray(buffer(data))
+  if data.itemsize != 4:
+    packed = bytearray(w * h * 4)
+    for i in xrange(4):
+      packed[i::4] = pixels[i::data.itemsize]
+    pixels = packed
+  image = pygame.image.frombuffer(pixels, (w, h), "RGBX")
+  surface.blit(image, dest)
+
+def wait_for_exit():
+  # Poczekaj aż okno zostanie zamknięte lub zostanie naciśnięty przycisk ESC.
+  # Bez ekranu (sterownik dummy) nie ma na co czekać.
+  if pygame.display.get_driver() == "dummy":
+    return
+  while True:
+    event = pygame.event.wait()
+    if event.type == KEYDOWN and event.key == K_ESCAPE:
+      break
+    if event.type == QUIT:
+      break
+
+
+def main():
+  # Porównanie czasu wyświetlenia bitmapy 640x480 piksel po pikselu (przez
+  # PixelArray) oraz jedną operacją blit. Domyślnie bez ekranu.
+  os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+  W = 640
+  H = 480
+  pygame.display.init()
+  window = pygame.display.set_mode([W, H], 0, 24)
+
+  bitmap = array.array('B', [0x20, 0x80, 0xe0]) * (W * H)
+
+  start = time.time()
+  pixels = pygame.PixelArray(window)
+  for y in xrange(H):
+    for x in xrange(W):
+      pixel = bitmap[(x + y * W) * 3:(x + y * W) * 3 + 3]
+      pixel = pixel[0] | (pixel[1] << 8) | (pixel[2] << 16)
+      pixels[x, y] = pixel
+  del pixels
+  print "PixelArray: %.3f s" % (time.time() - start)
+  expected = window.get_at((W - 1, H - 1))
+
+  window.fill((0, 0, 0))
+  start = time.time()
+  blit_bgr24(window, bitmap, W, H, (0, 0))
+  print "blit:       %.3f s" % (time.time() - start)
+  print "OK" if window.get_at((W - 1, H - 1)) == expected else "MISMATCH"
+
+  pygame.quit()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import array
+import mmap
+import struct
+
+BI_RGB = 0
+BI_RLE8 = 1
+
+
+def parse_bmp_header(data):
+  # Rozkoduj BITMAPFILEHEADER i BITMAPINFOHEADER (data to co najmniej
+  # początkowe 54 bajty pliku). Zwraca słownik z potrzebnymi polami lub None,
+  # jeśli to nie jest obsługiwany plik BMP. Wysokość jest liczbą ze znakiem -
+  # ujemna oznacza wiersze zapisane od góry do dołu.
+  if data[:2] != 'BM' or len(data) < 14 + 40:
+    # Nieprawidłowy plik BMP.
+    return None
+
+  bfType, bfSize, bfRes1, bfRes2, bfOffBits = struct.unpack("<HIHHI", data[:14])
+
+  (biSize, biWidth, biHeight, biPlanes, biBitCount, biCompression, biSizeImage,
+   biXPelsPerMeter, biYPelsPerMeter, biClrUser, biClrImportant) = struct.unpack(
+       "<IiiHHIIiiII", data[14:14 + 40])
+
+  if biSize != 40:
+    # Nieobsługiwany wariant BMP.
+    return None
+
+  return {
+      "offset": bfOffBits,
+      "width": biWidth,
+      "height": biHeight,
+      "bpp": biBitCount,
+      "compression": biCompression,
+      "clr_used": biClrUser,
+      }
+
+
+def MyLoadBMP(filename):
+  # Wczytaj cały plik do bufora.
+  with open(filename, "rb") as f:
+    data = f.read()
+
+  header = parse_bmp_header(data)
+  if header is None:
+    return None
+
+  offset, w, h = header["offset"], header["width"], header["height"]
+  if header["bpp"] == 24 and header["compression"] == BI_RGB:
+    return MyLoadBMP_RGB24(data, offset, w, h)
+  elif header["bpp"] == 8 and header["compression"] == BI_RLE8:
+    return MyLoadBMP_RLE8(data, offset, w, h, header["clr_used"])
+
+  # Nieobsługiwane kodowanie.
+  return None
+
+
+# Poniższe funkcje zwracają krotkę (w, h, 24, array('B')) z bitmapą BGR
+# zapisaną od góry do dołu. Samo dekodowanie odbywa się w funkcjach decode_*,
+# które zwracają bytearray - z nich korzysta też load_image (rozdział o
+# formacie PNG), dla którego kopia do array nie jest potrzebna.
+def MyLoadBMP_RGB24(data, pixel_offset, w, h):
+  return (w, abs(h), 24, _to_array(decode_rgb24(data, pixel_offset, w, h)))
+
+def MyLoadBMP_RLE8(data, pixel_offset, w, h, clr_used):
+  return (w, abs(h), 24,
+          _to_array(decode_rle8(data, pixel_offset, w, h, clr_used)))
+
+def _to_array(bitmap):
+  image = array.array('B')
+  image.fromstring(buffer(bitmap))
+  return image
+
+
+def decode_rle8(data, pixel_offset, w, h, clr_used):
+  # Czy wiersze są zapisane od dołu do góry?
+  bottom_up = True
+  if h < 0:
+    bottom_up = False
+    h = - h
+
+  # Przygotuj kolory BGR dla wszystkich 256 możliwych indeksów. Uznaj kolor za
+  # czarny jeśli indeks nie mieści się w palecie kolorów.
+  PALETTE_OFFSET = 0x0e + 0x28  # Wielkości obu nagłówków.
+  palette = data[PALETTE_OFFSET:PALETTE_OFFSET + clr_used * 4]
+  colors = [palette[i * 4:i * 4 + 3] for i in xrange(min(clr_used, 256))]
+  colors = [c if len(c) == 3 else '\0\0\0' for c in colors]
+  colors += ['\0\0\0'] * (256 - len(colors))
+
+  # Tablice (LUT) do zamiany indeksu na pojedynczą składową koloru - surowe
+  # dane są tłumaczone przez bytearray.translate osobno dla B, G i R, a wyniki
+  # trafiają co trzeci bajt bitmapy.
+  luts = [''.join(c[i] for c in colors) for i in xrange(3)]
+
+  # Zaalokuj bufor na 24-bitową bitmapę BGR. Wypełnij go kolorem tła
+  # (tj. pierwszym wpisem z palety kolorów).
+  bitmap = bytearray(colors[0]) * (w * h)
+  size = len(bitmap)
+
+  # Dane są przeglądane po indeksie. Uwaga: w Pythonie 2 indeksowanie
+  # memoryview zwraca jednoznakowe napisy, a nie liczby, dlatego dane są
+  # jednorazowo kopiowane do bytearray.
+  d = bytearray(buffer(data, pixel_offset))
+  n = len(d)
+  i = 0
+
+  # Uwaga: Poniżej nie ma praktycznie żadnego sprawdzania błędów - jedynie
+  # zapis jest ograniczony do rozmiaru bitmapy.
+  x = 0
+  row = 0
+  while i + 1 < n and row < h:
+    rle_opcode = d[i]
+    y = h - 1 - row if bottom_up else row
+
+    if rle_opcode > 0:  # Normalna kompersja RLE.
+      # Cała sekwencja jest zapisywana naraz jako powtórzony kolor.
+      pos = (x + y * w) * 3
+      count = min(rle_opcode, (size - pos) / 3)
+      if count > 0:
+        bitmap[pos:pos + count * 3] = colors[d[i + 1]] * count
+      x += rle_opcode
+      i += 2
+      continue
+
+    # Opkod jest równy 00 - pobierz opkod rozszerzający.
+    rle_opcode = d[i + 1]
+    i += 2
+    if rle_opcode == 0:  # 00 00 - Koniec wiersza..
+      x = 0
+      row += 1
+    elif rle_opcode == 1:  # 00 01 - Koniec bitmapy.
+      break
+    elif rle_opcode == 2:  # 00 02 XX YY - Przesuń kursor zapisu.
+      if i + 1 >= n:  # Urwane dane.
+        break
+      x += d[i]
+      row += d[i + 1]
+      i += 2
+
+    else:  # 00 NN ... - Surowe dane.
+      raw_count = rle_opcode
+      pos = (x + y * w) * 3
+      count = max(0, min(raw_count, (size - pos) / 3, n - i))
+      raw = d[i:i + count]
+      for channel in xrange(3):
+        bitmap[pos + channel:pos + count * 3:3] = raw.translate(luts[channel])
+      x += raw_count
+      i += raw_count + raw_count % 2  # Z ewentualnym bajtem paddingu.
+
+  return bitmap
+
+
+def decode_rgb24(data, pixel_offset, w, h):
+  # Czy wiersze są zapisane od dołu do góry?
+  bottom_up = True
+  if h < 0:
+    bottom_up = False
+    h = - h
+
+  # Oblicz pitch (długość wiersza w pliku, łącznie z paddingiem) oraz długość
+  # wiersza bez paddingu.
+  pitch = (w * 3 + 3) & ~3
+  row_size = w * 3
+
+  # Stwórz nowy bufor na odczytaną bitmapę (24 BPP, kolejność kolorów: BGR).
+  bitmap = bytearray(row_size * h)
+
+  # Wiersze są kopiowane w całości (bez paddingu) z widoku na dane pliku, więc
+  # jedyną kopią danych jest zapis do bitmapy. Przy zapisie od dołu do góry
+  # wiersze są po prostu przeglądane w odwrotnej kolejności.
+  rows = memoryview(data)[pixel_offset:]
+  if not bottom_up and pitch == row_size:
+    # Brak paddingu i odwracania - całą bitmapę można skopiować naraz.
+    pixels = rows[:row_size * h]
+    bitmap[:len(pixels)] = pixels
+  else:
+    if bottom_up:
+      r = xrange(h - 1, -1, -1)
+    else:
+      r = xrange(0, h)
+
+    src = 0
+    for y in r:
+      row = rows[src:src + row_size]
+      if len(row) != row_size:
+        break  # Niekompletne dane - reszta bitmapy pozostaje czarna.
+      bitmap[y * row_size:(y + 1) * row_size] = row
+      src += pitch
+
+  return bitmap
+
+
+# Leniwy dostęp do nieskompresowanych (BI_RGB, 24 BPP) plików BMP dowolnej
+# wielkości. Plik jest mapowany do pamięci, a położenie każdego wiersza jest
+# wyliczane z bfOffBits i pitch, więc nic nie jest wczytywane z góry. Wiersze i
+# fragmenty (tile) są zwracane jako widoki (buffer) na zmapowany plik, bez
+# kopiowania, a y zawsze liczone jest od góry obrazu - niezależnie od tego,
+# w jakiej kolejności wiersze zapisano w pliku. Piksele są w formacie BGR.
+class BMPView:
+  def __init__(self, filename):
+    with open(filename, "rb") as f:
+      try:
+        self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      except ValueError:
+        raise ValueError("empty file")
+
+    header = parse_bmp_header(self.data[:14 + 40])
+    if (header is None or header["bpp"] != 24 or
+        header["compression"] != BI_RGB):
+      self.close()
+      raise ValueError("unsupported BMP file")
+
+    self.width = header["width"]
+    self.height = abs(header["height"])
+    self.bottom_up = header["height"] > 0
+    self.offset = header["offset"]
+    self.row_size = self.width * 3
+    self.pitch = (self.row_size + 3) & ~3
+
+    if self.height and (self.offset + self.pitch * (self.height - 1) +
+                        self.row_size > len(self.data)):
+      self.close()
+      raise ValueError("truncated BMP file")
+
+  def close(self):
+    self.data.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def row_offset(self, y):
+    # Położenie w pliku wiersza y (licząc od góry obrazu).
+    if not 0 <= y < self.height:
+      raise IndexError("row out of range")
+    if self.bottom_up:
+      y = self.height - 1 - y
+    return self.offset + y * self.pitch
+
+  def row(self, y):
+    # Piksele wiersza y (bez paddingu).
+    return buffer(self.data, self.row_offset(y), self.row_size)
+
+  def tile(self, x, y, w, h):
+    # Lista widoków na kolejne (od góry) wiersze fragmentu o lewym górnym
+    # rogu (x, y) i wymiarach w x h, przyciętego do granic obrazu.
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, self.width), min(y + h, self.height)
+    if x0 >= x1:
+      return [buffer("") for _ in xrange(y0, y1)]
+    return [buffer(self.data, self.row_offset(row) + x0 * 3, (x1 - x0) * 3)
+            for row in xrange(y0, y1)]
+
+  def read_tile(self, x, y, w, h):
+    # Jak tile, ale fragment jest kopiowany do jednego, ciągłego bufora
+    # (bytearray) - pamięć jest potrzebna tylko na sam fragment.
+    rows = self.tile(x, y, w, h)
+    size = len(rows[0]) if rows else 0
+    tile = bytearray(size * len(rows))
+    for i, row in enumerate(rows):
+      tile[i * size:(i + 1) * size] = row
+    return tile
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import binascii
+import random
+import time
+
+# NumPy jest opcjonalny - przyspiesza jedynie generowanie szumu.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Generowanie syntetycznych obrazów (np. do testów wydajności). Obraz to
+# bytearray z wierszami zapisanymi od góry do dołu, bez paddingu. Kolory są
+# krotkami wartości kanałów - ich liczba wyznacza liczbę kanałów obrazu, np.
+# (r, g, b) daje obraz RGB, a (r, g, b, a) obraz RGBA. Kolejność kanałów można
+# później zmienić funkcją swizzle (np. na BGR, którego używa MyLoadBMP).
+#
+# Bufory są budowane z gotowych fragmentów przez powtarzanie (mnożenie
+# bytearray) i przypisania do wycinków, więc pojedyncze piksele nie są
+# przeglądane w Pythonie.
+
+
+def solid(w, h, color):
+  return bytearray(color) * (w * h)
+
+
+def color_ramp(colors, n):
+  # n kolorów (jako jeden bytearray) przechodzących płynnie (liniowo) przez
+  # kolejne kolory z listy colors, rozłożone równomiernie.
+  if len(colors) == 1 or n == 1:
+    return bytearray(colors[0]) * n
+
+  ramp = bytearray()
+  segments = len(colors) - 1
+  for i in xrange(n):
+    pos = float(i) * segments / (n - 1)
+    k = min(int(pos), segments - 1)
+    f = pos - k
+    ramp.extend(int(a + (b - a) * f + 0.5)
+                for a, b in zip(colors[k], colors[k + 1]))
+  return ramp
+
+
+def gradient(w, h, colors, vertical=False):
+  # Gradient przez kolejne kolory z listy colors, od lewej do prawej lub (dla
+  # vertical) od góry do dołu.
+  channels = len(colors[0])
+  if not vertical:
+    return color_ramp(colors, w) * h
+
+  ramp = color_ramp(colors, h)
+  row_size = w * channels
+  image = bytearray(row_size * h)
+  for y in xrange(h):
+    image[y * row_size:(y + 1) * row_size] = (
+        ramp[y * channels:(y + 1) * channels] * w)
+  return image
+
+
+def checkerboard(w, h, size, color1, color2):
+  # Szachownica z kwadratów size x size; lewy górny kwadrat ma kolor color1.
+  channels = len(color1)
+  row_size = w * channels
+  cell = size * channels
+  pair = bytearray(color1) * size + bytearray(color2) * size
+  repeat = w / (2 * size) + 1
+  row1 = (pair * repeat)[:row_size]
+  row2 = (pair[cell:] + pair * repeat)[:row_size]
+  return ((row1 * size + row2 * size) * (h / (2 * size) + 1))[:row_size * h]
+
+
+def noise(w, h, channels=3, seed=None):
+  # Losowe piksele (szum biały). Dla tego samego seed wynik jest zawsze taki
+  # sam, ale zależy od tego, czy dostępny jest NumPy.
+  size = w * h * channels
+  if numpy is not None:
+    rng = numpy.random.RandomState(seed)
+    return bytearray(rng.randint(0, 256, size, dtype=numpy.uint8).tostring())
+
+  rng = random.Random(seed)
+  image = bytearray()
+  CHUNK = 1 << 16
+  for start in xrange(0, size, CHUNK):
+    count = min(CHUNK, size - start)
+    image.extend(binascii.unhexlify("%0*x" % (count * 2,
+                                              rng.getrandbits(count * 8))))
+  return image
+
+
+def swizzle(data, src, dst, fill=0xff):
+  # Zmiana kolejności kanałów całej bitmapy, np. swizzle(data, "RGB", "BGR").
+  # src i dst to nazwy kanałów w pikselu - kanały z dst, których nie ma w src
+  # (np. "A" lub "X"), są wypełniane wartością fill. Każdy kanał jest
+  # kopiowany jedną operacją na wycinkach z krokiem.
+  pixels = bytearray(buffer(data))
+  count = len(pixels) / len(src)
+  image = bytearray(count * len(dst))
+  for i, channel in enumerate(dst):
+    if channel in src:
+      image[i::len(dst)] = pixels[src.index(channel)::len(src)]
+    else:
+      image[i::len(dst)] = bytearray([fill]) * count
+  return image
+
+
+def main():
+  # Czas wygenerowania obrazów 4096x4096 RGB.
+  W, H = 4096, 4096
+  for name, generate in (
+      ("gradient", lambda: gradient(W, H, [(0, 0, 0), (255, 0, 0)])),
+      ("vertical gradient",
+       lambda: gradient(W, H, [(0, 0, 255), (0, 255, 0), (255, 0, 0)], True)),
+      ("checkerboard",
+       lambda: checkerboard(W, H, 32, (255, 255, 255), (0, 0, 0))),
+      ("noise", lambda: noise(W, H, seed=1234)),
+      ("swizzle", lambda: swizzle(solid(W, H, (1, 2, 3)), "RGB", "BGR")),
+      ):
+    start = time.time()
+    generate()
+    print "%-18s %.3f s" % (name, time.time() - start)
+
+
+if __name__ == "__main__":
+  main()
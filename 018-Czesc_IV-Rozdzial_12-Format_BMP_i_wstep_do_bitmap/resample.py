@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from itertools import izip
+import math
+import time
+
+# NumPy jest opcjonalny - bez niego skalowanie odbywa się wiersz po wierszu w
+# czystym Pythonie (poprawnie, ale znacznie wolniej).
+try:
+  import numpy
+  from numpy.lib.stride_tricks import as_strided
+except ImportError:
+  numpy = None
+
+METHODS = ("nearest", "bilinear", "box")
+
+# Skalowanie bitmap o 8-bitowych kanałach. Bitmapa to bufor pikseli (np.
+# bytearray, array('B') lub mmap) opisany przez szerokość, wysokość, liczbę
+# kanałów w pikselu, stride (odległość w bajtach między początkami kolejnych
+# wierszy, domyślnie szerokość wiersza) i kolejność wierszy (bottom_up).
+# Wynikiem jest zawsze bytearray z wierszami zapisanymi jeden po drugim, od
+# góry do dołu, bez paddingu.
+#
+# Skalowanie jest rozdzielne: każdy piksel wyniku to suma ważona kilku
+# pikseli źródła (tzw. taps), wyznaczanych osobno dla osi X i Y:
+# - nearest - najbliższy piksel,
+# - bilinear - dwa sąsiednie piksele w każdej osi (interpolacja liniowa),
+# - box - wszystkie piksele źródła pokrywane przez piksel wyniku, z wagami
+#   proporcjonalnymi do pokrycia; najlepszy do zmniejszania obrazów.
+
+
+def fit_size(w, h, max_w, max_h):
+  # Największe wymiary mieszczące się w max_w x max_h, z zachowaniem proporcji.
+  scale = min(float(max_w) / w, float(max_h) / h)
+  return max(1, int(w * scale + 0.5)), max(1, int(h * scale + 0.5))
+
+
+def _taps(n, m, method):
+  # Dla każdej z m współrzędnych wyniku: lista par (współrzędna źródła, waga)
+  # przy skalowaniu z n do m.
+  scale = float(n) / m
+  taps = []
+  for x in xrange(m):
+    if method == "nearest":
+      taps.append([(min(int((x + 0.5) * scale), n - 1), 1.0)])
+    elif method == "bilinear":
+      center = (x + 0.5) * scale - 0.5
+      x0 = int(math.floor(center))
+      f = center - x0
+      taps.append([(min(max(x0, 0), n - 1), 1.0 - f),
+                   (min(max(x0 + 1, 0), n - 1), f)])
+    else:
+      start, end = x * scale, (x + 1) * scale
+      t = []
+      for i in xrange(int(start), min(int(math.ceil(end)), n)):
+        coverage = min(end, i + 1) - max(start, i)
+        if coverage > 0:
+          t.append((i, coverage))
+      total = sum(weight for i, weight in t)
+      taps.append([(i, weight / total) for i, weight in t])
+  return taps
+
+
+def resize(pixels, w, h, channels, new_w, new_h, method="box", stride=None,
+           bottom_up=False):
+  if method not in METHODS:
+    raise ValueError("unknown resampling method (%s)" % method)
+  if stride is None:
+    stride = w * channels
+
+  xtaps = _taps(w, new_w, method)
+  ytaps = _taps(h, new_h, method)
+  if numpy is not None:
+    return _resize_numpy(pixels, w, h, channels, new_w, new_h, stride,
+                         bottom_up, xtaps, ytaps)
+  return _resize_python(pixels, w, h, channels, new_w, new_h, stride,
+                        bottom_up, xtaps, ytaps)
+
+
+def _padded_taps(taps):
+  # Listy taps jako dwie tablice (indeksy, wagi) o stałej szerokości -
+  # brakujące pozycje powtarzają ostatni indeks z wagą 0 (dzięki temu zakres
+  # indeksów dla bloku wierszy wyniku się nie zwiększa).
+  k = max(len(t) for t in taps)
+  index = numpy.zeros((len(taps), k), dtype=numpy.intp)
+  weight = numpy.zeros((len(taps), k), dtype=numpy.float32)
+  for i, t in enumerate(taps):
+    index[i] = t[-1][0]
+    index[i, :len(t)] = [src for src, wgt in t]
+    weight[i, :len(t)] = [wgt for src, wgt in t]
+  return index, weight
+
+def _resize_numpy(pixels, w, h, channels, new_w, new_h, stride, bottom_up,
+                  xtaps, ytaps):
+  # Widok (bez kopiowania) na bitmapę jako tablicę (h, w, channels), z
+  # wierszami od góry do dołu.
+  flat = numpy.frombuffer(buffer(pixels), dtype=numpy.uint8)
+  image = as_strided(flat, shape=(h, w, channels),
+                     strides=(stride, channels, 1))
+  if bottom_up:
+    image = image[::-1]
+
+  xindex, xweight = _padded_taps(xtaps)
+  yindex, yweight = _padded_taps(ytaps)
+
+  # Wynik jest liczony blokami wierszy, tak by pośrednie tablice (wiersze
+  # źródła potrzebne dla bloku, po przeskalowaniu w poziomie) miały
+  # ograniczoną wielkość. Sumy ważone są liczone po jednej pozycji taps naraz
+  # dla całego bloku.
+  rows_per_output = float(h) / new_h + yindex.shape[1]
+  block = max(1, int((1 << 22) / (w * channels * rows_per_output)))
+
+  out = numpy.empty((new_h, new_w, channels), dtype=numpy.uint8)
+  for y0 in xrange(0, new_h, block):
+    index = yindex[y0:y0 + block]
+    lo, hi = index.min(), index.max() + 1
+    src = image[lo:hi]
+    rows = numpy.zeros((hi - lo, new_w, channels), dtype=numpy.float32)
+    for k in xrange(xindex.shape[1]):
+      rows += src[:, xindex[:, k], :] * xweight[None, :, k, None]
+    result = numpy.full((len(index), new_w, channels), 0.5,
+                        dtype=numpy.float32)
+    for k in xrange(index.shape[1]):
+      result += rows[index[:, k] - lo] * yweight[y0:y0 + block, k, None, None]
+    out[y0:y0 + block] = numpy.clip(result, 0, 255)
+  return bytearray(out.tostring())
+
+def _resize_python(pixels, w, h, channels, new_w, new_h, stride, bottom_up,
+                   xtaps, ytaps):
+  # Taps dla osi X rozpisane na poszczególne bajty (kanały) wiersza.
+  byte_taps = [[(src * channels + c, weight) for src, weight in t]
+               for t in xtaps for c in xrange(channels)]
+  row_size = w * channels
+
+  cache = { }  # Wiersze źródła przeskalowane w poziomie.
+  def scaled_row(y):
+    if y not in cache:
+      offset = (h - 1 - y if bottom_up else y) * stride
+      row = bytearray(buffer(pixels, offset, row_size))
+      cache[y] = [sum([row[i] * weight for i, weight in t]) for t in byte_taps]
+    return cache[y]
+
+  out = bytearray()
+  for t in ytaps:
+    # Wiersze źródła są przeglądane w kolejności, więc wcześniejsze nie będą
+    # już potrzebne.
+    for y in [y for y in cache if y < t[0][0]]:
+      del cache[y]
+    acc = [0.0] * (new_w * channels)
+    for y, weight in t:
+      acc = [a + v * weight for a, v in izip(acc, scaled_row(y))]
+    out.extend([min(255, int(v + 0.5)) for v in acc])
+  return out
+
+
+def resize_bitmap(bitmap, new_w, new_h, method="box"):
+  # Skalowanie obiektu Bitmap (patrz load_image w rozdziale o formacie PNG).
+  if bitmap.depth != 8:
+    raise ValueError("unsupported depth (%u)" % bitmap.depth)
+  channels = len(bitmap.format)
+  pixels = resize(bitmap.pixels, bitmap.width, bitmap.height, channels,
+                  new_w, new_h, method, bitmap.stride,
+                  bitmap.orientation == "bottom-up")
+  return type(bitmap)(new_w, new_h, bitmap.format, 8, new_w * channels,
+                      pixels, transparent=bitmap.transparent)
+
+
+# Piramida mip-map: kolejne poziomy to bitmapa zmniejszana za każdym razem o
+# połowę (filtrem box). Poziomy są wyznaczane przy pierwszym użyciu i
+# zapamiętywane, więc podglądy w różnych rozmiarach można tworzyć wielokrotnie,
+# za każdym razem skalując jedynie najbliższy (niewiele większy) poziom.
+class MipMap:
+  def __init__(self, pixels, w, h, channels, stride=None, bottom_up=False):
+    self.channels = channels
+    # Poziom: (szerokość, wysokość, piksele, stride, bottom_up).
+    self.levels = [(w, h, pixels, stride or w * channels, bottom_up)]
+
+  def level(self, n):
+    while len(self.levels) <= n:
+      w, h, pixels, stride, bottom_up = self.levels[-1]
+      if w == 1 and h == 1:
+        return self.levels[-1]
+      new_w, new_h = max(1, w / 2), max(1, h / 2)
+      self.levels.append((new_w, new_h,
+                          resize(pixels, w, h, self.channels, new_w, new_h,
+                                 "box", stride, bottom_up),
+                          new_w * self.channels, False))
+    return self.levels[n]
+
+  def preview(self, max_w, max_h, method="bilinear"):
+    # Podgląd mieszczący się w max_w x max_h. Zwraca (w, h, piksele).
+    w, h = self.levels[0][:2]
+    new_w, new_h = fit_size(w, h, max_w, max_h)
+
+    # Najmniejszy poziom, który nie jest mniejszy niż podgląd.
+    n = 0
+    while True:
+      next_level = self.level(n + 1)
+      if (next_level is self.level(n) or next_level[0] < new_w or
+          next_level[1] < new_h):
+        break
+      n += 1
+
+    w, h, pixels, stride, bottom_up = self.level(n)
+    return new_w, new_h, resize(pixels, w, h, self.channels, new_w, new_h,
+                                method, stride, bottom_up)
+
+
+def main():
+  # Zmniejsz duży, wygenerowany obraz każdą z metod i przez piramidę mip-map.
+  W, H = 4096, 4096
+  row = bytearray(xrange(256)) * (W * 3 / 256)
+  pixels = row * H
+  for method in METHODS:
+    start = time.time()
+    resize(pixels, W, H, 3, 640, 480, method)
+    print "%-8s 4096x4096 -> 640x480: %.3f s" % (method, time.time() - start)
+
+  mipmap = MipMap(pixels, W, H, 3)
+  for size in ((640, 480), (320, 240), (100, 100)):
+    start = time.time()
+    w, h, preview = mipmap.preview(*size)
+    print "preview %ux%u: %.3f s" % (w, h, time.time() - start)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from collections import deque
+from itertools import izip
+import re
+import struct
+import time
+
+from loadbmp import BI_RGB, BI_RLE8, MyLoadBMP
+
+# NumPy jest opcjonalny - bez niego paleta jest wyznaczana w pętli.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Kolejne wystąpienia tego samego bajtu (serie pikseli o tym samym kolorze).
+RUN_RE = re.compile(r"(.)\1*", re.S)
+
+
+def MySaveBMP(filename, w, h, bitmap, compression=BI_RGB):
+  # Zapisuje 24-bitową bitmapę BGR, zapisaną od góry do dołu (czyli w
+  # formacie zwracanym przez MyLoadBMP), jako 24-bitowy BMP (BI_RGB) lub
+  # 8-bitowy BMP z kompresją RLE (BI_RLE8). W drugim przypadku kolory są
+  # najpierw ograniczane do palety 256 kolorów (patrz quantize).
+  if compression == BI_RGB:
+    palette = ""
+    bpp = 24
+    data = _encode_rgb24(bitmap, w, h)
+  elif compression == BI_RLE8:
+    colors, indices = quantize(bitmap, w, h)
+    palette = "".join(color + "\0" for color in colors)
+    bpp = 8
+    data = encode_rle8(indices, w, h)
+  else:
+    raise ValueError("unsupported compression (%u)" % compression)
+
+  # BITMAPFILEHEADER, BITMAPINFOHEADER i paleta kolorów (BGR0).
+  offset = 14 + 40 + len(palette)
+  with open(filename, "wb") as f:
+    f.write(struct.pack("<2sIHHI", "BM", offset + len(data), 0, 0, offset))
+    f.write(struct.pack("<IiiHHIIiiII", 40, w, h, 1, bpp, compression,
+                        len(data), 2835, 2835, len(palette) / 4, 0))
+    f.write(palette)
+    f.write(data)
+
+
+def _encode_rgb24(bitmap, w, h):
+  # Wiersze są zapisywane od dołu do góry i uzupełniane do wielokrotności 4
+  # bajtów (pitch).
+  row_size = w * 3
+  pitch = (row_size + 3) & ~3
+  data = bytearray(pitch * h)
+  for y in xrange(h):
+    dst = (h - 1 - y) * pitch
+    data[dst:dst + row_size] = buffer(bitmap, y * row_size, row_size)
+  return data
+
+
+# Kwantyzacja kolorów: bitmapa BGR jest zamieniana na paletę (lista
+# 3-bajtowych napisów BGR, co najwyżej 256) i indeksy kolorów (bytearray,
+# jeden bajt na piksel). Jeśli obraz ma nie więcej niż 256 kolorów (np.
+# diagramy z jednolitymi kolorami), paleta jest dokładna. W przeciwnym wypadku
+# do palety trafia 256 najczęściej występujących kolorów (algorytm
+# popularności), a pozostałe kolory są zastępowane najbliższymi z palety.
+def quantize(bitmap, w, h, max_colors=256):
+  if numpy is not None:
+    return _quantize_numpy(bitmap, w, h, max_colors)
+  return _quantize_dict(bitmap, w, h, max_colors)
+
+def _quantize_numpy(bitmap, w, h, max_colors):
+  pixels = numpy.frombuffer(buffer(bitmap), dtype=numpy.uint8)
+  pixels = pixels[:w * h * 3].reshape(-1, 3).astype(numpy.uint32)
+  keys = pixels[:, 0] | (pixels[:, 1] << 8) | (pixels[:, 2] << 16)
+  colors, inverse, counts = numpy.unique(keys, return_inverse=True,
+                                         return_counts=True)
+
+  if len(colors) > max_colors:
+    palette = colors[numpy.argsort(counts)[-max_colors:]]
+    # Najbliższy kolor z palety dla każdego koloru obrazu (odległość
+    # euklidesowa w RGB), liczony w kawałkach by ograniczyć zużycie pamięci.
+    channels = lambda c: numpy.stack(
+        [(c >> shift) & 0xff for shift in (0, 8, 16)], axis=1).astype(
+            numpy.int32)
+    target = channels(palette)
+    nearest = numpy.empty(len(colors), dtype=numpy.intp)
+    for start in xrange(0, len(colors), 4096):
+      diff = channels(colors[start:start + 4096])[:, None, :] - target[None]
+      nearest[start:start + 4096] = (diff * diff).sum(axis=2).argmin(axis=1)
+    colors = palette
+    inverse = nearest[inverse]
+
+  palette = [struct.pack("<I", c)[:3] for c in colors.tolist()]
+  return palette, bytearray(inverse.astype(numpy.uint8).tostring())
+
+def _quantize_dict(bitmap, w, h, max_colors):
+  pixels = bytearray(buffer(bitmap, 0, w * h * 3))
+  counts = { }
+  keys = []
+  for b, g, r in izip(pixels[0::3], pixels[1::3], pixels[2::3]):
+    key = b | (g << 8) | (r << 16)
+    counts[key] = counts.get(key, 0) + 1
+    keys.append(key)
+
+  colors = sorted(counts, key=counts.get, reverse=True)[:max_colors]
+  mapping = dict((c, i) for i, c in enumerate(colors))
+  if len(counts) > max_colors:
+    split = lambda c: (c & 0xff, (c >> 8) & 0xff, c >> 16)
+    targets = [split(c) for c in colors]
+    for key in counts:
+      if key not in mapping:
+        b, g, r = split(key)
+        mapping[key] = min(
+            xrange(len(targets)),
+            key=lambda i: ((targets[i][0] - b) ** 2 + (targets[i][1] - g) ** 2 +
+                           (targets[i][2] - r) ** 2))
+
+  palette = [struct.pack("<I", c)[:3] for c in colors]
+  return palette, bytearray(mapping[key] for key in keys)
+
+
+# Kompresja RLE8. Wiersz może być zapisany jako ciąg:
+# - sekwencji powtórzeń (NN XX - 2 bajty, 1-255 pikseli w tym samym kolorze),
+# - surowych sekwencji (00 NN XX... - 2 + NN bajtów plus bajt paddingu dla
+#   nieparzystego NN, 3-255 dowolnych pikseli).
+# Podział wiersza na sekwencje, dający najmniejszy rozmiar danych, jest
+# wyznaczany przez programowanie dynamiczne: best[p] to najmniejszy rozmiar
+# zapisu pikseli od p do końca wiersza. Punkty podziału są ograniczone do
+# granic serii pikseli w tym samym kolorze (i sąsiednich pikseli - przesunięcie
+# o jeden piksel pozwala uniknąć bajtu paddingu) oraz do podziałów długich
+# serii co 255 pikseli, więc dla obrazów z dużymi jednolitymi obszarami
+# liczba rozważanych punktów jest niewielka.
+def encode_rle8(indices, w, h):
+  data = bytearray()
+  for y in xrange(h - 1, -1, -1):
+    _encode_rle8_row(indices[y * w:(y + 1) * w], data)
+    data.extend((0, 0))  # Koniec wiersza.
+  data.extend((0, 1))  # Koniec bitmapy.
+  return data
+
+def _encode_rle8_row(row, data):
+  w = len(row)
+  if w == 0:
+    return
+
+  # Serie pikseli w tym samym kolorze i punkty, w których wiersz może zostać
+  # podzielony.
+  run_end = { }
+  points = set([w])
+  for m in RUN_RE.finditer(str(row)):
+    s, e = m.span()
+    points.update((s, s + 1, e - 1))
+    for p in xrange(s + 255, e, 255):
+      points.update((p, e - (p - s)))
+    run_end[s] = e
+  points = sorted(p for p in points if 0 <= p <= w)
+
+  # Koniec serii, do której należy każdy punkt podziału.
+  ends = []
+  current_end = 0
+  for p in points:
+    if p in run_end:
+      current_end = run_end[p]
+    ends.append(current_end)
+
+  n = len(points)
+  best = [0] * n
+  choice = [None] * n
+
+  # Minimum z (q + best[q]) w oknie punktów q, dla których surowa sekwencja od
+  # p do q ma od 3 do 255 pikseli - osobno dla parzystych i nieparzystych q
+  # (od parzystości długości zależy bajt paddingu).
+  windows = (deque(), deque())
+  added = n - 1
+
+  for i in xrange(n - 2, -1, -1):
+    p = points[i]
+
+    # Sekwencja powtórzeń do dowolnego punktu w tej samej serii.
+    limit = min(ends[i], p + 255)
+    k = i + 1
+    while k < n and points[k] <= limit:
+      cost = 2 + best[k]
+      if choice[i] is None or cost < best[i]:
+        best[i] = cost
+        choice[i] = (False, k)
+      k += 1
+
+    # Surowa sekwencja.
+    while added > i and points[added] >= p + 3:
+      q = points[added]
+      window = windows[q & 1]
+      value = q + best[added]
+      while window and window[-1][0] >= value:
+        window.pop()
+      window.append((value, added))
+      added -= 1
+    for parity in (0, 1):
+      window = windows[parity]
+      while window and points[window[0][1]] > p + 255:
+        window.popleft()
+      if window:
+        value, k = window[0]
+        cost = 2 - p + value + ((points[k] - p) & 1)
+        if cost < best[i]:
+          best[i] = cost
+          choice[i] = (True, k)
+
+  # Odtworzenie wybranego podziału.
+  i = 0
+  while i < n - 1:
+    raw, k = choice[i]
+    p, q = points[i], points[k]
+    if raw:
+      data.extend((0, q - p))
+      data.extend(row[p:q])
+      if (q - p) & 1:
+        data.append(0)  # Bajt paddingu.
+    else:
+      data.extend((q - p, row[p]))
+    i = k
+
+
+def main():
+  # Zapisz test.bmp w obu formatach i sprawdź, czy po odczytaniu bitmapa się
+  # nie zmieniła.
+  w, h, bpp, bitmap = MyLoadBMP("test.bmp")
+  for fname, compression in (("test_out.bmp", BI_RGB),
+                             ("test_out_rle8.bmp", BI_RLE8)):
+    start = time.time()
+    MySaveBMP(fname, w, h, bitmap, compression)
+    elapsed = time.time() - start
+    check = MyLoadBMP(fname)
+    print "%s: %.3f s, %s" % (fname, elapsed,
+                              "OK" if check == (w, h, bpp, bitmap) else
+                              "changed (more than 256 colors)")
+
+
+if __name__ == "__main__":
+  main()
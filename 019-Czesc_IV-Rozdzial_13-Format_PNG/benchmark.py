@@ -0,0 +1,300 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmark dekoderów obrazów: PNGReader z tego rozdziału oraz MyLoadBMP z
+# rozdziału o formacie BMP. Zestaw testowych obrazów jest generowany
+# deterministycznie (ten sam seed daje te same pliki), więc wyniki zapisane w
+# pliku JSON można porównywać między kolejnymi wersjami kodu.
+#
+# Każdy pomiar (dekoder + plik) odbywa się w osobnym procesie, dzięki czemu
+# szczytowe zużycie pamięci (ru_maxrss) dotyczy tylko tego jednego pomiaru.
+from getopt import getopt, GetoptError
+from multiprocessing import Process, Queue
+from Queue import Empty
+from struct import pack
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from decodepng import PNGReader, write_bmp
+from encodepng import PNGWriter
+
+from loadimage import Bitmap, load_image
+
+# Dekoder BMP przeglądarek z poprzedniego rozdziału (katalog dodany do
+# sys.path przez loadimage).
+from loadbmp import MyLoadBMP
+
+DEFAULT_SIZES = (64, 256, 512)
+PNG_FILTERS = (None, 0, 1, 2, 3, 4)  # None - wybór filtra dla każdego wiersza.
+PNG_LEVELS = (1, 6, 9)
+RLE8_RUN_LENGTHS = (1, 4, 16, 255)  # 1 - same surowe (absolute) sekwencje.
+SEED = 1234
+
+# Dekodery: nazwa -> (rodzaje obsługiwanych plików, funkcja dekodująca).
+LOADERS = {
+    "png": (("png",), lambda fname: PNGReader(fname).decode()),
+    "png-threaded": (("png",),
+                     lambda fname: PNGReader(fname, threaded=True).decode()),
+    "png-nocrc": (("png",), lambda fname: PNGReader(fname, crc="none").decode()),
+    "image": (("png", "bmp24", "rle8"), load_image),
+    "bmp": (("bmp24", "rle8"), MyLoadBMP),
+    }
+
+
+# Generowanie obrazów testowych.
+# Obraz to gradient (dobrze kompresowalny i korzystający z filtrów) z
+# wstawkami losowego szumu (praktycznie niekompresowalnego). Wiersze są
+# składane wyłącznie z wycinków, więc generowanie nie wymaga NumPy.
+def random_bytes(rng, n):
+  if n == 0:
+    return bytearray()
+  return bytearray(("%0*x" % (n * 2, rng.getrandbits(n * 8))).decode("hex"))
+
+def make_pixels(rng, w, h, bpp):
+  row_size = w * bpp
+  base = bytearray(xrange(256)) * ((row_size * 2) / 256 + 1)
+  noise = random_bytes(rng, row_size * 2)
+  pixels = bytearray()
+  for y in xrange(h):
+    shift = y % 256
+    row = base[shift:shift + row_size]
+    start = rng.randrange(row_size)
+    length = rng.randrange(row_size - start + 1) / 4
+    offset = rng.randrange(row_size)
+    row[start:start + length] = noise[offset:offset + length]
+    pixels.extend(row)
+  return pixels
+
+def make_bitmap(rng, w, h):
+  return {
+      "width": w,
+      "height": h,
+      "format": "RGB",
+      "depth": 8,
+      "stride": w * 3,
+      "transparent": None,
+      "pixels": make_pixels(rng, w, h, 3),
+      }
+
+def write_bmp_rle8(fname, rng, w, h, run_length):
+  # 8-bitowa bitmapa BI_RLE8 z losową paletą. Wiersze są złożone z sekwencji
+  # o długości run_length (krótsze tylko na końcu wiersza); run_length równe
+  # 1 oznacza surowe sekwencje (00 NN ...) zamiast powtórzeń.
+  palette = random_bytes(rng, 256 * 4)
+  data = bytearray()
+  for y in xrange(h):
+    x = 0
+    while x < w:
+      if run_length == 1:
+        count = min(255, w - x)
+        if count < 3:
+          # Surowa sekwencja musi mieć co najmniej 3 piksele.
+          for index in random_bytes(rng, count):
+            data.extend((1, index))
+        else:
+          data.extend((0, count))
+          data.extend(random_bytes(rng, count))
+          if count % 2 != 0:
+            data.append(0)  # Bajt paddingu.
+      else:
+        count = min(run_length, w - x)
+        data.extend((count, rng.randrange(256)))
+      x += count
+    data.extend((0, 0))  # Koniec wiersza.
+  data[-1] = 1  # Koniec bitmapy.
+
+  offset = 14 + 40 + len(palette)
+  with open(fname, "wb") as f:
+    f.write(pack("<2sIHHI", "BM", offset + len(data), 0, 0, offset))
+    f.write(pack("<IiiHHIIiiII", 40, w, h, 1, 8, 1, len(data), 0, 0, 256, 0))
+    f.write(palette)
+    f.write(data)
+
+def make_corpus(corpus_dir, sizes):
+  # Zwraca listę opisów plików testowych; istniejące pliki nie są generowane
+  # ponownie (nazwa pliku zawiera wszystkie parametry).
+  if not os.path.isdir(corpus_dir):
+    os.makedirs(corpus_dir)
+
+  corpus = []
+  for size in sizes:
+    rng = random.Random("%u-%u" % (SEED, size))
+    bitmap = make_bitmap(rng, size, size)
+
+    for level in PNG_LEVELS:
+      for filter_type in PNG_FILTERS:
+        fname = os.path.join(corpus_dir, "img_%u_f%s_l%u.png" % (
+            size, "a" if filter_type is None else filter_type, level))
+        if not os.path.exists(fname):
+          PNGWriter(fname, level=level, filter_type=filter_type).encode(bitmap)
+        corpus.append({ "kind": "png", "file": fname, "width": size,
+                        "height": size, "filter": filter_type, "level": level })
+
+    fname = os.path.join(corpus_dir, "img_%u.bmp" % size)
+    if not os.path.exists(fname):
+      write_bmp(fname, bitmap)
+    corpus.append({ "kind": "bmp24", "file": fname, "width": size,
+                    "height": size })
+
+    for run_length in RLE8_RUN_LENGTHS:
+      fname = os.path.join(corpus_dir, "img_%u_rle%u.bmp" % (size, run_length))
+      if not os.path.exists(fname):
+        rng = random.Random("%u-%u-%u" % (SEED, size, run_length))
+        write_bmp_rle8(fname, rng, size, size, run_length)
+      corpus.append({ "kind": "rle8", "file": fname, "width": size,
+                      "height": size, "run_length": run_length })
+  return corpus
+
+
+# Pomiary.
+def decoded_size(image):
+  # Wielkość zdekodowanej bitmapy w bajtach (słownik z PNGReader.decode,
+  # Bitmap z load_image lub krotka (w, h, bpp, array) z MyLoadBMP).
+  if isinstance(image, dict):
+    return len(image["pixels"])
+  if isinstance(image, Bitmap):
+    return len(image.pixels)
+  return len(image[3]) * image[3].itemsize
+
+def _measure(loader, fname, repeats, results):
+  try:
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    load = LOADERS[loader][1]
+    best = None
+    for i in xrange(repeats):
+      start = time.time()
+      image = load(fname)
+      elapsed = time.time() - start
+      if image is None:
+        raise ValueError("unsupported file")
+      best = elapsed if best is None else min(best, elapsed)
+      size = decoded_size(image)
+      del image
+    results.put({
+        "time": best,
+        "decoded_bytes": size,
+        "mb_per_s": size / best / (1 << 20) if best > 0 else None,
+        "base_rss_kb": base_rss,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+  except Exception as e:
+    results.put({ "error": "%s: %s" % (type(e).__name__, e) })
+
+def measure(loader, fname, repeats):
+  # Proces pomiaru może zginąć bez zwrócenia wyniku (np. zabity przez OOM
+  # killer lub po naruszeniu ochrony pamięci), więc na wynik nie czekamy w
+  # nieskończoność - martwy proces daje wynik z błędem.
+  results = Queue()
+  p = Process(target=_measure, args=(loader, fname, repeats, results))
+  p.start()
+  result = None
+  while result is None:
+    try:
+      result = results.get(timeout=1)
+    except Empty:
+      if not p.is_alive():
+        # Wynik mógł trafić do kolejki tuż przed zakończeniem procesu.
+        try:
+          result = results.get_nowait()
+        except Empty:
+          result = { "error": "process exited with code %s" % p.exitcode }
+  p.join()
+  return result
+
+def git_commit():
+  try:
+    with open(os.devnull, "wb") as null:
+      return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                     stderr=null).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def run(corpus, loaders, repeats, callback=None):
+  results = []
+  for loader in loaders:
+    kinds = LOADERS[loader][0]
+    for entry in corpus:
+      if entry["kind"] not in kinds:
+        continue
+      result = dict(entry)
+      result["loader"] = loader
+      result["file_size"] = os.path.getsize(entry["file"])
+      result["file"] = os.path.basename(entry["file"])
+      result.update(measure(loader, entry["file"], repeats))
+      if callback is not None:
+        callback(result)
+      results.append(result)
+  return results
+
+
+def usage():
+  print "usage: benchmark.py [-s sizes] [-r repeats] [-l loaders] " \
+        "[-d corpus_dir] [-o output.json]"
+  print "  sizes i loaders oddzielone przecinkami, dostępne dekodery: %s" % (
+      ", ".join(sorted(LOADERS)))
+
+def main():
+  try:
+    opts, args = getopt(sys.argv[1:], "s:r:l:d:o:h")
+  except GetoptError as e:
+    print str(e)
+    usage()
+    return 1
+
+  sizes = DEFAULT_SIZES
+  repeats = 3
+  loaders = sorted(LOADERS)
+  corpus_dir = os.path.join(tempfile.gettempdir(), "image_benchmark_corpus")
+  output = "benchmark.json"
+  for opt, value in opts:
+    if opt == "-s":
+      sizes = [int(size) for size in value.split(",")]
+    elif opt == "-r":
+      repeats = int(value)
+    elif opt == "-l":
+      loaders = value.split(",")
+    elif opt == "-d":
+      corpus_dir = value
+    elif opt == "-o":
+      output = value
+    else:
+      usage()
+      return 0
+
+  for loader in loaders:
+    if loader not in LOADERS:
+      print "unknown loader: %s" % loader
+      usage()
+      return 1
+
+  corpus = make_corpus(corpus_dir, sizes)
+
+  def report(result):
+    if "error" in result:
+      print "%-12s %-24s ERROR %s" % (result["loader"], result["file"],
+                                      result["error"])
+    else:
+      print "%-12s %-24s %8.2f MB/s %8u KB" % (
+          result["loader"], result["file"], result["mb_per_s"] or 0,
+          result["peak_rss_kb"])
+
+  results = run(corpus, loaders, repeats, report)
+  with open(output, "w") as f:
+    json.dump({
+        "commit": git_commit(),
+        "python": sys.version,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "repeats": repeats,
+        "results": results,
+        }, f, indent=2, sort_keys=True)
+  print "results written to %s" % output
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
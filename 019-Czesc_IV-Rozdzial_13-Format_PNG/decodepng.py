@@ -1,14 +1,39 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from struct import unpack
-from zlib import crc32
+from contextlib import closing
+from getopt import getopt, GetoptError
+from itertools import izip
+from Queue import Full, Queue
+from struct import pack, unpack, unpack_from
+from threading import Event, Thread
+from zlib import crc32, decompressobj
+import binascii
+import mmap
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
 
-# Niewielka ale bardzo pomocna klasa do odczytu danych z buforu.
+# NumPy jest opcjonalny - bez niego filtry są odwracane na typie bytearray.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Niewielka ale bardzo pomocna klasa do odczytu danych z buforu. Bufor może
+# być napisem, ale również dowolnym obiektem obsługującym buffer protocol
+# (np. mmap) - liczby są odczytywane przez unpack_from, a get_view zwraca
+# widok na dane zamiast ich kopii.
 class StreamReader:
   def __init__(self, data):
     self.offset = 0
     self.data = data
 
+  def _check_size(self, size):
+    if self.offset + size > len(self.data):
+      raise PNGError("unexpected end of data")
+
   def peek_block(self, size):
     return self.data[self.offset:self.offset + size]
 
@@ -17,6 +42,54 @@ class StreamReader:
     self.offset += size
     return b
 
+  def get_view(self, size):
+    # Uwaga: w Python 2 zlib i crc32 akceptują tylko "stare" bufory (buffer),
+    # a nie memoryview.
+    self._check_size(size)
+    b = buffer(self.data, self.offset, size)
+    self.offset += size
+    return b
+
+  def get_uint32(self):
+    self._check_size(4)
+    v = unpack_from(">I", self.data, self.offset)[0]
+    self.offset += 4
+    return v
+
+  def get_uint16(self):
+    self._check_size(2)
+    v = unpack_from(">H", self.data, self.offset)[0]
+    self.offset += 2
+    return v
+
+  def get_uint8(self):
+    self._check_size(1)
+    v = unpack_from("B", self.data, self.offset)[0]
+    self.offset += 1
+    return v
+
+# Wariant StreamReader, który czyta dane bezpośrednio z otwartego pliku,
+# zamiast trzymać cały plik w pamięci.
+class FileStreamReader(StreamReader):
+  def __init__(self, f):
+    StreamReader.__init__(self, None)
+    self.f = f
+
+  def peek_block(self, size):
+    b = self.f.read(size)
+    self.f.seek(-len(b), 1)
+    return b
+
+  def get_block(self, size):
+    b = self.f.read(size)
+    if len(b) != size:
+      raise PNGError("unexpected end of file")
+    self.offset += size
+    return b
+
+  def get_view(self, size):
+    return self.get_block(size)
+
   def get_uint32(self):
     return unpack(">I", self.get_block(4))[0]
 
@@ -26,23 +99,179 @@ class StreamReader:
   def get_uint8(self):
     return ord(self.get_block(1))
 
+# Mapowanie całego pliku do pamięci (tylko do odczytu).
+def map_file(f):
+  try:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except ValueError:
+    # Pustego pliku nie da się zmapować.
+    raise PNGError("unexpected end of file")
+
 # Wyjątek rzucany w przypadku błędu w dekodowaniu.
 class PNGError(Exception):
   pass
 
-class PNGReader:
+PNG_HEADER = "\x89PNG\r\n\x1a\n"
+
+# Obsługiwane typy kolorów: format zdekodowanej bitmapy, liczba kanałów w
+# pliku oraz dozwolone głębie bitowe (liczba bitów na kanał).
+COLOR_TYPES = {
+    0: ("L", 1, (1, 2, 4, 8, 16)),  # Skala szarości.
+    2: ("RGB", 3, (8, 16)),          # Truecolor.
+    3: ("RGB", 1, (1, 2, 4, 8)),     # Paleta kolorów (indeksy do PLTE).
+    4: ("LA", 2, (8, 16)),           # Skala szarości z kanałem alfa.
+    6: ("RGBA", 4, (8, 16)),         # Truecolor z kanałem alfa.
+    }
+
+# Przebiegi przeplotu Adam7: pierwsza kolumna, pierwszy wiersz oraz odstępy
+# między kolejnymi kolumnami i wierszami danego przebiegu.
+ADAM7 = (
+    (0, 0, 8, 8),
+    (4, 0, 8, 8),
+    (0, 4, 4, 8),
+    (2, 0, 4, 4),
+    (0, 2, 2, 4),
+    (1, 0, 2, 2),
+    (0, 1, 1, 2),
+    )
+
+# Rozkodowanie pól bloku IHDR do podanego słownika.
+def parse_IHDR(data, header):
+  data = StreamReader(data)
+  header["width"]       = data.get_uint32()
+  header["height"]      = data.get_uint32()
+  header["bpp"]         = data.get_uint8()
+  header["color"]       = data.get_uint8()
+  header["compression"] = data.get_uint8()
+  header["filter"]      = data.get_uint8()
+  header["interlace"]   = data.get_uint8()
+  return header
+
+# Lekka alternatywa dla PNGReader na potrzeby odczytu samych metadanych.
+# Nagłówek jest odczytywany z pierwszych 33 bajtów pliku (sygnatura + blok
+# IHDR). Opcjonalnie można zbudować indeks bloków (typ, pozycja w pliku,
+# długość danych) - w tym celu dane bloków są przeskakiwane za pomocą seek,
+# więc ani dane IDAT, ani ich CRC32 nie są w ogóle wczytywane.
+class PNGInfo:
+  IHDR_END = len(PNG_HEADER) + 8 + 13 + 4
+
   def __init__(self, fname):
     self.fname = fname
+    self.header = { }
+    self.chunks = [ ]
+
+  def read(self, chunk_index=False):
+    with open(self.fname, "rb") as f:
+      data = f.read(self.IHDR_END)
+      if len(data) != self.IHDR_END or not data.startswith(PNG_HEADER):
+        raise PNGError("incorrect magic")
+
+      png = StreamReader(data)
+      png.get_block(len(PNG_HEADER))
+      length = png.get_uint32()
+      chunk_type = png.get_block(4)
+      if chunk_type != "IHDR" or length != 13:
+        raise PNGError("IHDR is not the first chunk")
+
+      # Blok IHDR jest mały, więc jego CRC32 można tanio sprawdzić.
+      ihdr = png.get_block(length)
+      if png.get_uint32() != crc32(ihdr, crc32(chunk_type)) & 0xffffffff:
+        raise PNGError("chunk IHDR CRC32 incorrect")
+
+      parse_IHDR(ihdr, self.header)
+      self.chunks.append({
+          "type": chunk_type,
+          "offset": len(PNG_HEADER),
+          "length": length
+          })
+
+      if chunk_index:
+        self._index_chunks(f)
+
+    return self.header
+
+  def _index_chunks(self, f):
+    png = FileStreamReader(f)
+    while True:
+      offset = f.tell()
+      length = png.get_uint32()
+      chunk_type = png.get_block(4)
+      self.chunks.append({
+          "type": chunk_type,
+          "offset": offset,
+          "length": length
+          })
+      if chunk_type == "IEND":
+        break
+
+      # Przeskocz dane i CRC32 bloku.
+      f.seek(length + 4, 1)
+
+class PNGReader:
+  INFLATE_INPUT = 1 << 16
+  # Minimalna wielkość kawałków zdekompresowanych danych - dla wąskich
+  # obrazów kawałek obejmuje wiele wierszy, więc zlib nie jest wywoływany
+  # (i unconsumed_tail kopiowany) osobno dla każdego z nich.
+  INFLATE_OUTPUT = 16 << 10
+  # Wielkość kawałków zdekompresowanych danych i długość kolejki między
+  # wątkami przy dekodowaniu potokowym (threaded).
+  PIPELINE_BUFFER = 1 << 16
+  PIPELINE_DEPTH = 8
+  # Sprawdzanie sum kontrolnych bloków:
+  # - "full" - wszystkie bloki, przed ich przetworzeniem,
+  # - "ihdr" - tylko nagłówek,
+  # - "none" - żadne,
+  # - "lazy" - wszystkie bloki, ale w osobnym wątku; błąd jest zgłaszany
+  #   dopiero po zdekodowaniu bitmapy.
+  CRC_POLICIES = ("full", "ihdr", "none", "lazy")
+
+  # Opcjonalne parametry rows i columns to zakresy (pierwszy, ostatni + 1)
+  # wierszy i kolumn do zdekodowania. Dekodowanie kończy się zaraz po
+  # odtworzeniu ostatniego potrzebnego wiersza, a z każdego wiersza
+  # zachowywane są tylko wybrane kolumny.
+  # Jeśli threaded jest ustawione, dekompresja odbywa się w osobnym wątku,
+  # równolegle z odwracaniem filtrów (patrz _pipeline).
+  # Parametr crc określa, które sumy kontrolne bloków są sprawdzane (patrz
+  # CRC_POLICIES) - dla zaufanych plików (np. z własnego kodera) można
+  # ograniczyć się do nagłówka lub całkiem pominąć sprawdzanie.
+  def __init__(self, fname, rows=None, columns=None, threaded=False,
+               crc="full"):
+    if crc not in self.CRC_POLICIES:
+      raise PNGError("unsupported CRC policy (%s)" % crc)
+    self.fname = fname
+    self.threaded = threaded
+    self.crc = crc
+    self.crc_queue = None
+    self.crc_errors = []
+    self.rows = rows
+    self.columns = columns
     self.png = None
-    self.bitmap_data = []
+    self.inflater = None
+    self.palette = None
+    self.transparency = None
     self.header = { }
+    # Zdekodowana bitmapa to jeden ciągły bufor (bytearray) z wierszami
+    # zapisanymi jeden po drugim, od góry do dołu. Pole stride to odległość
+    # (w bajtach) między początkami kolejnych wierszy, a format opisuje
+    # kolejność kanałów w pikselu ("L", "LA", "RGB" lub "RGBA"). Pola width i
+    # height to wymiary bitmapy (przy dekodowaniu fragmentu obrazu - wymiary
+    # tego fragmentu; pełne wymiary są w nagłówku). Kanały mają
+    # po depth bitów - 8 lub 16 (16-bitowe wartości są zapisane big-endian,
+    # tak jak w PNG). Obrazy z paletą są rozwijane do RGB/RGBA, a skala
+    # szarości o głębi 1, 2 i 4 bitów - do 8 bitów. Dla typów 0 i 2 blok tRNS
+    # nie dodaje kanału alfa - przezroczysty kolor trafia do pola transparent.
     self.bitmap = {
         "header": self.header,
-        "rgb": [ ]
+        "width": 0,
+        "height": 0,
+        "format": "RGB",
+        "depth": 8,
+        "stride": 0,
+        "transparent": None,
+        "pixels": None
         }
 
   def _verify_magic(self):
-    PNG_HEADER = "\x89PNG\r\n\x1a\n"
     return PNG_HEADER == self.png.get_block(len(PNG_HEADER))
 
   def _read_chunk(self):
@@ -50,9 +279,17 @@ class PNGReader:
     chunk = { }
     chunk["length"] = self.png.get_uint32()
     chunk["type"]   = self.png.get_block(4)
-    chunk["data"]   = self.png.get_block(chunk["length"])
+    chunk["data"]   = self.png.get_view(chunk["length"])
     chunk["crc32"]  = self.png.get_uint32()
 
+    if self.crc == "full" or (self.crc == "ihdr" and chunk["type"] == "IHDR"):
+      self._verify_chunk(chunk)
+    elif self.crc == "lazy":
+      self.crc_queue.put(chunk)
+
+    return chunk
+
+  def _verify_chunk(self, chunk):
     # Wylicz CRC32 z type i data.
     crc = crc32(chunk["type"])
     crc = crc32(chunk["data"], crc) & 0xffffffff
@@ -60,27 +297,33 @@ class PNGReader:
     if chunk["crc32"] != crc:
       raise PNGError("chunk %s CRC32 incorrect" % chunk["type"])
 
-    return chunk
+  def _verify_chunks(self):
+    # Wątek sprawdzający sumy kontrolne w trybie "lazy". Dane bloków to
+    # widoki na zmapowany plik, więc wątek musi zakończyć pracę zanim plik
+    # zostanie zamknięty - koniec pracy oznacza None w kolejce.
+    # Uwaga: W Pythonie 2 crc32 nie zwalnia GIL, więc sprawdzanie nie
+    # przebiega w pełni równolegle z dekodowaniem, ale nie opóźnia ono
+    # zwrócenia pierwszych wierszy.
+    while True:
+      chunk = self.crc_queue.get()
+      if chunk is None:
+        return
+      try:
+        self._verify_chunk(chunk)
+      except PNGError as e:
+        self.crc_errors.append(e)
 
   def _process_IHDR(self, chunk):
     # Wczytaj pola nagłówka.
-    data = StreamReader(chunk["data"])
-    self.header["width"]       = data.get_uint32()
-    self.header["height"]      = data.get_uint32()
-    self.header["bpp"]         = data.get_uint8()
-    self.header["color"]       = data.get_uint8()
-    self.header["compression"] = data.get_uint8()
-    self.header["filter"]      = data.get_uint8()
-    self.header["interlace"]   = data.get_uint8()
-
-    # Ten dekoder obsługuje tylko PNG typu 24-bpp bez przeplotu. Sprawdź czy
-    # dekodowany plik zawiera dokładnie taki PNG.
-    if self.header["bpp"] != 8:
-      raise PNGError("unsupported bpp (%u)" % self.header["bpp"])
+    parse_IHDR(chunk["data"], self.header)
 
-    if self.header["color"] != 2:
+    # Sprawdź czy typ koloru i głębia bitowa są poprawne.
+    if self.header["color"] not in COLOR_TYPES:
       raise PNGError("unsupported color type (%u)" % self.header["color"])
 
+    if self.header["bpp"] not in COLOR_TYPES[self.header["color"]][2]:
+      raise PNGError("unsupported bpp (%u)" % self.header["bpp"])
+
     if self.header["compression"] != 0:
       raise PNGError("unsupported compression type (%u)" %
                      self.header["compression"])
@@ -88,63 +331,343 @@ class PNGReader:
     if self.header["filter"] != 0:
       raise PNGError("unsupported filter type (%u)" % self.header["filter"])
 
-    if self.header["interlace"] != 0:
+    if self.header["interlace"] not in (0, 1):
       raise PNGError("unsupported interlace type (%u)" %
                      self.header["interlace"])
 
     return
 
-  def _process_IDAT(self, chunk):
-    # Dodaj dane do bitmap_data. Zostaną zdekompresowane później.
-    self.bitmap_data.append(chunk["data"])
+  def _process_PLTE(self, chunk):
+    # Paleta to ciąg trójek RGB (maksymalnie 256).
+    if chunk["length"] % 3 != 0 or chunk["length"] > 256 * 3:
+      raise PNGError("invalid PLTE length (%u)" % chunk["length"])
+    self.palette = str(chunk["data"])
+
+  def _process_tRNS(self, chunk):
+    # Dla palety: wartości alfa kolejnych wpisów palety (brakujące mają 255).
+    # Dla skali szarości i RGB: jeden przezroczysty kolor (16-bitowe próbki).
+    self.transparency = str(chunk["data"])
+
+  def _process_IDAT(self, chunk, limit=None):
+    # Dane z bloków IDAT są dekompresowane na bieżąco i zwracane w kawałkach
+    # nie większych niż limit bajtów - domyślnie jest to jeden wiersz lub
+    # INFLATE_OUTPUT bajtów (większa z tych wartości), więc zlib nigdy nie
+    # zwraca więcej danych naraz, a reszta wejścia czeka w unconsumed_tail. Ponieważ unconsumed_tail jest kopią
+    # nieprzetworzonego wejścia, dane bloku są podawane do zlib w kawałkach
+    # nie większych niż INFLATE_INPUT (jako widoki na zmapowany plik, bez
+    # kopiowania).
+    if self.inflater is None:
+      self._start_bitmap_data()
+
+    for start in xrange(0, len(chunk["data"]), self.INFLATE_INPUT):
+      data = buffer(chunk["data"], start, self.INFLATE_INPUT)
+      while True:
+        max_length = limit or max(self.row_size + 1, self.INFLATE_OUTPUT)
+        raw = self.inflater.decompress(data, max_length)
+        data = self.inflater.unconsumed_tail
+        if raw:
+          yield raw
+        if not data and len(raw) < max_length:
+          break
+
+  def _read_bitmap_data(self, limit=None):
+    # Odczytuje i przetwarza kolejne bloki, zwracając zdekompresowane dane
+    # bitmapy (patrz _process_IDAT).
+    # Uwaga: Niniejszy, przykładowy dekoder nie sprawdza czy bloki wystapiły
+    # w określonej w dokumentacji ilości oraz kolejności.
+    chunk_handlers = {
+        "IHDR": self._process_IHDR,
+        "PLTE": self._process_PLTE,
+        "tRNS": self._process_tRNS,
+        }
+
+    while True:
+      chunk = self._read_chunk()
+      if chunk["type"] == "IEND":
+        break
+
+      if chunk["type"] == "IDAT":
+        for raw in self._process_IDAT(chunk, limit):
+          yield raw
+        continue
+
+      if chunk["type"] in chunk_handlers:
+        chunk_handlers[chunk["type"]](chunk)
+        continue
+
+      print "warning: chunk %s not handled, ignoring" % chunk["type"]
+
+    # Reszta danych, które mogły zostać w dekompresorze.
+    if self.inflater is None:
+      raise PNGError("no IDAT chunks")
+    yield self.inflater.flush()
+
+  def _pipeline(self, source):
+    # Dekompresja w osobnym wątku (producent): kawałki danych o stałej
+    # wielkości trafiają do ograniczonej kolejki, z której odbiera je wątek
+    # odwracający filtry (konsument). zlib zwalnia GIL na czas dekompresji,
+    # więc oba etapy faktycznie działają równolegle, a kolejka ogranicza
+    # ilość zdekompresowanych, a jeszcze nieprzetworzonych danych.
+    # Wyjątek zgłoszony przez producenta jest przekazywany konsumentowi.
+    queue = Queue(self.PIPELINE_DEPTH)
+    stop = Event()
+
+    def put(item):
+      # Konsument mógł już skończyć (np. przy dekodowaniu fragmentu), więc
+      # producent nie może czekać na miejsce w kolejce w nieskończoność.
+      while not stop.is_set():
+        try:
+          queue.put(item, timeout=0.1)
+          return True
+        except Full:
+          pass
+      return False
+
+    def producer():
+      try:
+        for raw in source:
+          if not put(("data", raw)):
+            return
+        put(("end", None))
+      except Exception:
+        put(("error", sys.exc_info()))
+      finally:
+        source.close()
+
+    thread = Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+    try:
+      while True:
+        kind, item = queue.get()
+        if kind == "end":
+          return
+        if kind == "error":
+          raise item[0], item[1], item[2]
+        yield item
+    finally:
+      # Producent korzysta ze zmapowanego pliku, więc musi zakończyć pracę
+      # zanim plik zostanie zamknięty.
+      stop.set()
+      thread.join()
 
   # Implementacja filtrów wg. dokumentacji PNG.
-  def _paeth(self, a, b, c):
-    p = a + b - c
-    pa = abs(p - a)
-    pb = abs(p - b)
-    pc = abs(p - c)
-    if pa <= pb and pa <= pc:
-      return a
-    elif pb <= pc:
-      return b
-    return c
-
-  def _decode_row_none(self, row, off_x, prior, data):
-    row.extend(data)
-
-  def _decode_row_sub(self, row, off_x, prior, data):
-    for x in xrange(len(data)):
-      row.append((data[x] + row[off_x + x - 3]) & 0xff)
-
-  def _decode_row_up(self, row, off_x, prior, data):
-    for x in xrange(len(data)):
-      row.append((data[x] + prior[off_x + x]) & 0xff)
-
-  def _decode_row_average(self, row, off_x, prior, data):
-    for x in xrange(len(data)):
-      row.append((data[x] + (row[off_x + x - 3] + prior[off_x + x]) / 2) & 0xff)
-
-  def _decode_row_paeth(self, row, off_x, prior, data):
-    for x in xrange(len(data)):
-      pred = self._paeth(row[off_x + x - 3], prior[off_x + x],
-                         prior[off_x + x - 3])
-      row.append((data[x] + pred) & 0xff)
+  # Każda z poniższych metod odwraca filtr dla całego wiersza naraz i zwraca
+  # nowy wiersz (numpy.ndarray jeśli NumPy jest dostępny, w przeciwnym wypadku
+  # bytearray). Parametr prior to poprzedni, już zdekodowany wiersz (dla
+  # pierwszego wiersza - same zera), a bpp to liczba bajtów na piksel, czyli
+  # odległość (w bajtach) do "lewego" sąsiada.
+  #
+  # Filtry None i Up nie mają zależności między bajtami w wierszu, więc
+  # z NumPy są pojedynczą operacją wektorową. Sub to suma prefiksowa liczona
+  # osobno dla każdego kanału. Average i Paeth zależą od właśnie
+  # zdekodowanego lewego sąsiada, więc wymagają pętli - ale tylko jednej na
+  # kanał, w której jedyną przenoszoną między iteracjami wartością jest
+  # poprzedni bajt danego kanału. Wszystko, co zależy wyłącznie od
+  # poprzedniego wiersza, jest wyliczane wcześniej.
+  def _decode_row_none(self, prior, data, bpp):
+    if numpy is not None:
+      return numpy.frombuffer(data, dtype=numpy.uint8)
+    return bytearray(data)
+
+  def _decode_row_sub(self, prior, data, bpp):
+    if numpy is not None:
+      # cumsum z dtype=uint8 zawija się modulo 256, tak jak wymaga PNG.
+      row = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, bpp)
+      return numpy.cumsum(row, axis=0, dtype=numpy.uint8).reshape(-1)
+
+    row = bytearray(data)
+    for ch in xrange(bpp):
+      a = 0
+      chain = []
+      for x in row[ch::bpp]:
+        a = (x + a) & 0xff
+        chain.append(a)
+      row[ch::bpp] = bytearray(chain)
+    return row
+
+  def _decode_row_up(self, prior, data, bpp):
+    if numpy is not None:
+      return numpy.frombuffer(data, dtype=numpy.uint8) + prior
+
+    return bytearray([(x + b) & 0xff for x, b in izip(bytearray(data), prior)])
+
+  def _decode_row_average(self, prior, data, bpp):
+    row = bytearray(data)
+    if numpy is not None:
+      prior = prior.tolist()
+
+    for ch in xrange(bpp):
+      a = 0
+      chain = []
+      for x, b in izip(row[ch::bpp], prior[ch::bpp]):
+        a = (x + ((a + b) >> 1)) & 0xff
+        chain.append(a)
+      row[ch::bpp] = bytearray(chain)
+
+    if numpy is not None:
+      return numpy.frombuffer(bytes(row), dtype=numpy.uint8)
+    return row
+
+  def _decode_row_paeth(self, prior, data, bpp):
+    # Predyktor Paeth dla lewego (a), górnego (b) i lewego-górnego (c) bajtu
+    # liczy p = a + b - c, a następnie:
+    #   pa = |p - a| = |b - c|
+    #   pb = |p - b| = |a - c|
+    #   pc = |p - c| = |(a - c) + (b - c)|
+    # Zatem b, c, pa i (b - c) zależą tylko od poprzedniego wiersza i można je
+    # policzyć przed pętlą.
+    if numpy is not None:
+      b = prior.astype(numpy.int16)
+      c = numpy.zeros_like(b)
+      c[bpp:] = b[:-bpp]
+      d = b - c
+      pa = numpy.abs(d)
+      b, c, d, pa = b.tolist(), c.tolist(), d.tolist(), pa.tolist()
+    else:
+      b = list(prior)
+      c = [0] * bpp + b[:-bpp]
+      d = [pb - pc for pb, pc in izip(b, c)]
+      pa = [abs(v) for v in d]
+
+    row = bytearray(data)
+    for ch in xrange(bpp):
+      a = 0
+      chain = []
+      for x, bb, cc, dd, ppa in izip(row[ch::bpp], b[ch::bpp], c[ch::bpp],
+                                     d[ch::bpp], pa[ch::bpp]):
+        t = a - cc
+        pb = abs(t)
+        pc = abs(t + dd)
+        if ppa <= pb and ppa <= pc:
+          pred = a
+        elif pb <= pc:
+          pred = bb
+        else:
+          pred = cc
+        a = (x + pred) & 0xff
+        chain.append(a)
+      row[ch::bpp] = bytearray(chain)
+
+    if numpy is not None:
+      return numpy.frombuffer(bytes(row), dtype=numpy.uint8)
+    return row
   # Koniec filtrów.
 
-  def _process_bitmap_data(self, data):
-    # Dekompresja.
-    data = StreamReader(data.decode("zlib"))
-   
-    # Chwilowo dodam cały wiersz z zerami. Również na początku każdego wiersza
-    # będę dodawać po kilka zera - uprości to logikę filtrów (tj. nie będzie
-    # konieczne sprawdzanie czy piksel z poprzedniego wiersza/kolumny istnieje.
-    # Wg. dokumentacji taki piksel na potrzeby filtrów powinien mieć wartość 0.
-    rows = []
-    rows.append([0] * ((self.header["width"] + 1) * 3))
-    off_y = 1  # Pozycja pierwszego wiersza prawdziwej bitmapy w rows.
-    off_x = 3  # Pozycja pierwszego bajtu prawdziwej bitmapy w wierszu.
+  def _start_bitmap_data(self):
+    width = self.header["width"]
+    depth = self.header["bpp"]
+    color = self.header["color"]
+    fmt, channels, _ = COLOR_TYPES[color]
+    bits = channels * depth
+
+    # Liczba bajtów na piksel (dla głębi poniżej 8 bitów filtry operują na
+    # pojedynczych bajtach).
+    self.bpp = max(1, bits / 8)
+    self.bits = bits
+
+    # Fragment obrazu do zdekodowania.
+    x0, x1 = self.columns or (0, width)
+    y0, y1 = self.rows or (0, self.header["height"])
+    if not (0 <= x0 < x1 <= width and 0 <= y0 < y1 <= self.header["height"]):
+      raise PNGError("invalid region")
+    self.partial = (x1 - x0, y1 - y0) != (width, self.header["height"])
+
+    # Obraz bez przeplotu to jeden przebieg obejmujący całą bitmapę. Przy
+    # przeplocie Adam7 każdy z (niepustych) przebiegów to osobny,
+    # pomniejszony obraz z własnymi filtrami.
+    if self.header["interlace"] == 1:
+      layout = ADAM7
+    else:
+      layout = ((0, 0, 1, 1), )
+
+    # Dla każdego przebiegu wyliczany jest też zakres jego kolumn (col0 -
+    # col1) i wierszy (row0 - row1), które trafiają do wybranego fragmentu,
+    # oraz pozycja pierwszego z tych pikseli w wynikowej bitmapie (out_x,
+    # out_y). Wiersze przed row0 muszą zostać zdekodowane (filtry zależą od
+    # poprzedniego wiersza), ale wiersze od row1 można już tylko pominąć.
+    ceil_div = lambda a, b: -(-a // b)
+    self.passes = []
+    for n, (x, y, dx, dy) in enumerate(layout):
+      pass_width = ceil_div(width - x, dx)
+      pass_height = ceil_div(self.header["height"] - y, dy)
+      if pass_width <= 0 or pass_height <= 0:
+        continue
 
+      col0 = max(0, ceil_div(x0 - x, dx))
+      col1 = min(pass_width, ceil_div(x1 - x, dx))
+      row0 = max(0, ceil_div(y0 - y, dy))
+      row1 = min(pass_height, ceil_div(y1 - y, dy))
+      if col0 >= col1 or row0 >= row1:
+        # Przebieg nie ma pikseli we fragmencie - pomiń wszystkie wiersze.
+        row0 = row1 = 0
+
+      self.passes.append({
+          "pass": n + 1,
+          "x": x, "y": y, "dx": dx, "dy": dy,
+          "width": pass_width, "height": pass_height,
+          "col0": col0, "col1": col1, "row0": row0, "row1": row1,
+          "out_x": x + col0 * dx - x0, "out_y": y + row0 * dy - y0
+          })
+
+    # Po ostatnim wierszu ostatniego przebiegu, który ma piksele we
+    # fragmencie, dekodowanie można przerwać.
+    self.last_pass = max(i for i, p in enumerate(self.passes) if p["row1"])
+
+    # Przygotuj konwersję wierszy do formatu wyjściowego.
+    self.unpack_lut = None
+    self.palette_lut = None
+    out_depth = depth
+    if color == 3:
+      if self.palette is None:
+        raise PNGError("missing PLTE chunk")
+      fmt, self.palette_lut = self._build_palette_lut()
+      out_depth = 8
+      if depth < 8:
+        self.unpack_lut = self._build_unpack_lut(depth, 1)
+    elif color == 0 and depth < 8:
+      # Od razu przeskaluj wartości do pełnego zakresu 0-255.
+      scale = 255 / ((1 << depth) - 1)
+      self.unpack_lut = self._build_unpack_lut(depth, scale)
+      out_depth = 8
+      if self.transparency is not None:
+        self.bitmap["transparent"] = (
+            (unpack(">H", self.transparency[:2])[0] & 0xff) * scale, )
+    elif self.transparency is not None:
+      samples = unpack(">%uH" % channels, self.transparency[:channels * 2])
+      if depth == 8:
+        samples = tuple(v & 0xff for v in samples)
+      self.bitmap["transparent"] = samples
+
+    self.bitmap["width"] = x1 - x0
+    self.bitmap["height"] = y1 - y0
+    self.bitmap["format"] = fmt
+    self.bitmap["depth"] = out_depth
+    self.bitmap["stride"] = (x1 - x0) * len(fmt) * out_depth / 8
+
+    self.inflater = decompressobj()
+    self.pending = bytearray()  # Zdekompresowane dane niepełnego wiersza.
+    self._start_pass(0)
+
+  def _start_pass(self, pass_no):
+    # Przejdź do kolejnego przebiegu. Po ostatnim pass_no jest równe
+    # len(self.passes).
+    self.pass_no = pass_no
+    self.pass_y = 0  # Liczba zdekodowanych wierszy w bieżącym przebiegu.
+    if pass_no == len(self.passes):
+      return
+
+    self.pass_width = self.passes[pass_no]["width"]
+    self.row_size = (self.pass_width * self.bits + 7) / 8
+
+    # Wg. dokumentacji piksele spoza bitmapy (np. wiersz nad pierwszym
+    # wierszem przebiegu) mają na potrzeby filtrów wartość 0.
+    if numpy is not None:
+      self.prior_data = numpy.zeros(self.row_size, dtype=numpy.uint8)
+    else:
+      self.prior_data = bytearray(self.row_size)
+
+  def _process_bitmap_data(self, data):
     # Obsługa poszczególnych filtrów.
     filter_handlers = [
         self._decode_row_none,
@@ -154,67 +677,405 @@ class PNGReader:
         self._decode_row_paeth,
         ]
 
-    # Odwrócenie filtrów dla każdego wiersza.
-    for y in xrange(self.header["height"]):
-      filter_type = data.get_uint8()
-      if filter_type >= len(filter_handlers):
-        raise PNGError("invalid PNG filter")
+    # Odwrócenie filtrów dla każdego kompletnego wiersza. Pamiętany jest
+    # jedynie poprzedni wiersz oraz początek następnego. Przetworzone wiersze
+    # są usuwane z self.pending dopiero na końcu, bo przy dużych kawałkach
+    # danych usuwanie każdego wiersza z osobna oznaczałoby wielokrotne
+    # przesuwanie reszty bufora.
+    self.pending.extend(data)
+    pending = self.pending
+    pos = 0
+    try:
+      while (self.pass_no < len(self.passes) and
+             len(pending) - pos > self.row_size):
+        p = self.passes[self.pass_no]
+        start, pos = pos, pos + self.row_size + 1
+        if self.pass_y >= p["row1"]:
+          # Wiersz poza wybranym fragmentem - nie ma potrzeby go dekodować.
+          self.pass_y += 1
+        else:
+          filter_type = pending[start]
+          if filter_type >= len(filter_handlers):
+            raise PNGError("invalid PNG filter")
 
-      filtered_data = map(ord, data.get_block(self.header["width"] * 3))
-      prior_data = rows[off_y + (y - 1)]  # Poprzedni wiersz.
-      row_data = [0] * off_x  # Tablica na zdekodowane wartości.
-      filter_handlers[filter_type](row_data, off_x, prior_data, filtered_data)
-      rows.append(row_data)
+          filtered_data = pending[start + 1:pos]
+          row_data = filter_handlers[filter_type](self.prior_data,
+                                                  filtered_data, self.bpp)
+          self.prior_data = row_data
+          self.pass_y += 1
+          if self.pass_y > p["row0"]:
+            yield self._convert_row(row_data, p)
 
-    # Usunięcie dodanych wcześniej nadmiarowych zer.
-    rows.pop(0)
-    for r in rows:
-      r.pop(0)
-      r.pop(0)
-      r.pop(0)      
+        if self.pass_no == self.last_pass and self.pass_y == p["row1"]:
+          # Wszystkie potrzebne wiersze są już zdekodowane.
+          self._start_pass(len(self.passes))
+        elif self.pass_y == p["height"]:
+          self._start_pass(self.pass_no + 1)
+    finally:
+      del pending[:pos]
 
-    self.bitmap["rgb"].extend(rows)
+  # Konwersja wierszy do formatu wyjściowego. Zarówno rozpakowanie pikseli
+  # o głębi 1, 2 i 4 bitów, jak i rozwinięcie palety odbywają się przez
+  # tablice (LUT) indeksowane wartością bajtu - z NumPy jako jedno
+  # indeksowanie tablicy, bez NumPy przez bytearray.translate.
+  def _build_unpack_lut(self, depth, scale):
+    # Dla każdej możliwej wartości bajtu: 8 / depth kolejnych pikseli.
+    per_byte = 8 / depth
+    mask = (1 << depth) - 1
+    lut = []
+    for b in xrange(256):
+      lut.append(bytearray(
+          ((b >> (8 - depth * (i + 1))) & mask) * scale
+          for i in xrange(per_byte)))
 
-  def decode(self):
-    with open(self.fname, "rb") as f:
-      self.png = StreamReader(f.read())
+    if numpy is not None:
+      return numpy.array(lut, dtype=numpy.uint8)
+    return [str(v) for v in lut]
 
-    # Sprawdzenie nagłówka.
-    if not self._verify_magic():
-      raise PNGError("incorrect magic")
+  def _convert_row(self, row, p):
+    # Piksele o głębi poniżej 8 bitów są najpierw rozpakowywane do bajtów.
+    # Przycięcie wiersza do wybranych kolumn odbywa się przed rozwinięciem
+    # palety, więc LUT dotyczy tylko potrzebnych pikseli.
+    if self.unpack_lut is not None:
+      row = self._unpack_row(row, self.unpack_lut)
+    if p["col0"] != 0 or p["col1"] != p["width"]:
+      row = row[p["col0"] * self.bpp:p["col1"] * self.bpp]
+    if self.palette_lut is not None:
+      row = self._expand_palette(row, self.palette_lut)
+    return row
 
-    # Odczytanie i przetworzenie kolejnych bloków.
-    # Uwaga: Niniejszy, przykładowy dekoder nie sprawdza czy bloki wystapiły
-    # w określonej w dokumentacji ilości oraz kolejności.
-    chunk_handlers = {
-        "IHDR": self._process_IHDR,
-        "IDAT": self._process_IDAT,
-        }
+  def _unpack_row(self, row, lut):
+    width = self.pass_width
+    if numpy is not None:
+      return lut[row].reshape(-1)[:width]
+    return bytearray(''.join([lut[b] for b in row]))[:width]
 
-    while True:
-      chunk = self._read_chunk()
-      if chunk["type"] == "IEND":
-        break
+  def _build_palette_lut(self):
+    # Indeksy spoza palety dają czarny, nieprzezroczysty kolor.
+    palette = bytearray(self.palette)
+    palette.extend([0] * (256 * 3 - len(palette)))
+    channels = [palette[0::3], palette[1::3], palette[2::3]]
+    fmt = "RGB"
+    if self.transparency is not None:
+      alpha = bytearray(self.transparency[:256])
+      alpha.extend([0xff] * (256 - len(alpha)))
+      channels.append(alpha)
+      fmt = "RGBA"
 
-      if chunk["type"] in chunk_handlers:
-        chunk_handlers[chunk["type"]](chunk)
-        continue
+    if numpy is not None:
+      return fmt, numpy.array(channels, dtype=numpy.uint8).T.copy()
+    return fmt, [str(ch) for ch in channels]
 
-      print "warning: chunk %s not handled, ignoring" % chunk["type"]
+  def _expand_palette(self, row, lut):
+    if numpy is not None:
+      return lut[row].reshape(-1)
+
+    channels = len(lut)
+    out = bytearray(len(row) * channels)
+    for ch in xrange(channels):
+      out[ch::channels] = row.translate(lut[ch])
+    return out
+
+  def iter_rows(self):
+    # Strumieniowe dekodowanie: plik jest czytany blok po bloku, a kolejne
+    # wiersze (numpy.ndarray lub bytearray z pikselami w formacie
+    # self.bitmap["format"]) są zwracane zaraz po ich zdekodowaniu. Nagłówek
+    # (self.header) jest dostępny od momentu otrzymania pierwszego wiersza.
+    # Zwrócony wiersz może być jednocześnie "poprzednim wierszem" dla
+    # filtrów, więc nie należy go modyfikować.
+    # W przypadku przeplotu zwracane są wiersze kolejnych przebiegów Adam7.
+    # Przebieg, do którego należy ostatnio zwrócony wiersz, to
+    # self.passes[self.pass_no], a jego numer w przebiegu to self.pass_y - 1.
+    # Przy dekodowaniu fragmentu (rows/columns) zwracane są tylko wiersze z
+    # tego fragmentu, przycięte do wybranych kolumn.
+    # Plik jest mapowany do pamięci, a dane bloków są jedynie widokami na
+    # zmapowany obszar - dane IDAT trafiają do zlib bez kopiowania.
+    with open(self.fname, "rb") as f, closing(map_file(f)) as data:
+      self.png = StreamReader(data)
+
+      # Sprawdzenie nagłówka.
+      if not self._verify_magic():
+        raise PNGError("incorrect magic")
+
+      if self.crc == "lazy":
+        self.crc_queue = Queue()
+        verifier = Thread(target=self._verify_chunks)
+        verifier.daemon = True
+        verifier.start()
+
+      # Odczytanie i przetworzenie kolejnych bloków oraz odwrócenie filtrów.
+      if self.threaded:
+        source = self._pipeline(self._read_bitmap_data(self.PIPELINE_BUFFER))
+      else:
+        source = self._read_bitmap_data()
+      try:
+        for raw in source:
+          for row in self._process_bitmap_data(raw):
+            yield row
+          if self.partial and self.pass_no == len(self.passes):
+            # Przy dekodowaniu fragmentu nie ma potrzeby czytać reszty pliku.
+            break
+      except Exception:
+        # Uszkodzone dane zwykle powodują też błąd dekompresji lub filtrów.
+        # Jeśli weryfikacja w tle wykryła niepoprawną sumę CRC, to ona jest
+        # zgłaszana jako przyczyna.
+        exc_info = sys.exc_info()
+        if self.crc == "lazy":
+          self.crc_queue.put(None)
+          verifier.join()
+          if self.crc_errors:
+            raise self.crc_errors[0]
+        raise exc_info[0], exc_info[1], exc_info[2]
+      finally:
+        source.close()
+        if self.crc == "lazy":
+          self.crc_queue.put(None)
+          verifier.join()
+
+    if self.crc_errors:
+      raise self.crc_errors[0]
+
+    if self.pass_no != len(self.passes):
+      raise PNGError("truncated bitmap data")
+
+  # Parametr progress to opcjonalna funkcja wywoływana po zdekodowaniu
+  # każdego przebiegu z opisem przebiegu (słownik z self.passes) oraz
+  # bitmapą, w której piksele tego i wcześniejszych przebiegów są już na
+  # swoich miejscach. Przy przeplocie pozwala to wyświetlić zgrubny podgląd
+  # obrazu już po pierwszym przebiegu.
+  def decode(self, progress=None):
+    pixels = None
+    for row in self.iter_rows():
+      if pixels is None:
+        # Nagłówek jest już znany - zaalokuj bufor na całą bitmapę.
+        stride = self.bitmap["stride"]
+        pixel_size = stride / self.bitmap["width"]
+        pixels = bytearray(stride * self.bitmap["height"])
+        self.bitmap["pixels"] = pixels
+        if numpy is not None:
+          # Widok NumPy na ten sam bufor pozwala kopiować wiersze bez
+          # konwersji do bytes.
+          pixels_view = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        else:
+          pixels_view = pixels
+
+      # Umieść wiersz przebiegu w odpowiednim wierszu i kolumnach bitmapy.
+      p = self.passes[self.pass_no]
+      y = p["out_y"] + (self.pass_y - 1 - p["row0"]) * p["dy"]
+      offset = y * stride
+      if p["dx"] == 1:
+        pixels_view[offset:offset + stride] = row
+      else:
+        # Piksele przebiegu są rozrzucone co dx pikseli - skopiuj je jednym
+        # przypisaniem do wycinka z krokiem dla każdego bajtu piksela.
+        start = offset + p["out_x"] * pixel_size
+        step = p["dx"] * pixel_size
+        for i in xrange(pixel_size):
+          pixels_view[start + i:offset + stride:step] = row[i::pixel_size]
+
+      if progress is not None and self.pass_y == p["row1"]:
+        progress(p, self.bitmap)
 
-    # Rozkoduj dane bitmapy.
-    self._process_bitmap_data(''.join(self.bitmap_data))
     return self.bitmap
 
 
+# Zapis zdekodowanej bitmapy jako 24-bitowy BMP (BI_RGB). Kanał alfa jest
+# pomijany, skala szarości powielana na B, G i R, a z 16-bitowych próbek
+# brany jest starszy bajt. Kanały są przepisywane wycinkami z krokiem - po
+# jednym przypisaniu na kanał i wiersz.
+def write_bmp(fname, bitmap):
+  width = bitmap["width"]
+  height = bitmap["height"]
+  stride = bitmap["stride"]
+  pixels = bitmap["pixels"]
+  sample_size = bitmap["depth"] / 8
+  pixel_size = stride / width
+
+  # Indeksy kanałów źródłowych dla kolejno B, G i R.
+  bgr = {
+      "L": (0, 0, 0),
+      "LA": (0, 0, 0),
+      "RGB": (2, 1, 0),
+      "RGBA": (2, 1, 0),
+      }[bitmap["format"]]
+
+  pitch = (width * 3 + 3) & ~3
+  with open(fname, "wb") as f:
+    f.write(pack("<HIHHI", 0x4d42, 14 + 40 + pitch * height, 0, 0, 14 + 40))
+    f.write(pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, pitch * height,
+                 2835, 2835, 0, 0))
+
+    # BMP przechowuje wiersze od dołu do góry.
+    out = bytearray(pitch)
+    for y in xrange(height - 1, -1, -1):
+      row = pixels[y * stride:(y + 1) * stride]
+      for i, ch in enumerate(bgr):
+        out[i:width * 3:3] = row[ch * sample_size::pixel_size]
+      f.write(out)
+
+# Zdekodowanie jednego pliku w procesie roboczym puli. Wynik zawiera czas
+# dekodowania oraz ew. błąd. Piksele nie są przesyłane przez potok puli -
+# trafiają albo do pliku wyjściowego, albo do pliku w pamięci współdzielonej
+# (/dev/shm; shm to katalog i prefiks nazwy pliku), albo - jeśli nie podano
+# żadnego z nich - są pomijane.
+def _decode_batch_item(task):
+  fname, out_dir, out_format, shm = task
+  result = {
+      "fname": fname,
+      "error": None,
+      "output": None,
+      }
+
+  start = time.time()
+  try:
+    bitmap = PNGReader(fname).decode()
+    result["header"] = bitmap["header"]
+    for key in ("width", "height", "format", "depth", "stride",
+                "transparent"):
+      result[key] = bitmap[key]
+
+    if out_dir is not None:
+      base = os.path.splitext(os.path.basename(fname))[0]
+      result["output"] = os.path.join(out_dir, base + "." + out_format)
+      if out_format == "bmp":
+        write_bmp(result["output"], bitmap)
+      else:
+        with open(result["output"], "wb") as f:
+          f.write(bitmap["pixels"])
+    elif shm is not None:
+      shm_dir, shm_prefix = shm
+      fd, result["shm"] = tempfile.mkstemp(suffix=".raw", prefix=shm_prefix,
+                                           dir=shm_dir)
+      with os.fdopen(fd, "wb") as f:
+        f.write(bitmap["pixels"])
+  except Exception as e:
+    # Błąd jednego pliku nie powinien przerywać całej paczki.
+    result["error"] = "%s: %s" % (e.__class__.__name__, e)
+
+  result["time"] = time.time() - start
+  return result
+
+# Dekodowanie wielu plików PNG równolegle w puli procesów (PNGReader jest
+# napisany w czystym Pythonie, więc wątki nie pomogłyby ze względu na GIL).
+# Jeśli podano out_dir, bitmapy są zapisywane do plików .raw lub .bmp. W
+# przeciwnym wypadku, jeśli keep_pixels jest prawdą, wynik zawiera klucz "shm"
+# ze ścieżką pliku z pikselami w pamięci współdzielonej - plik należy do
+# wołającego, który powinien go odczytać przez map_batch_pixels (lub usunąć).
+# Pliki nie są mapowane z góry, bo przy dziesiątkach tysięcy plików
+# zabrakłoby deskryptorów i pamięci. Wyniki są zwracane w kolejności plików
+# wejściowych; callback (jeśli podany) jest wołany dla każdego wyniku zaraz
+# po jego otrzymaniu.
+def decode_batch(fnames, out_dir=None, out_format="raw", processes=None,
+                 callback=None, keep_pixels=True):
+  shm = None
+  if out_dir is None and keep_pixels:
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    shm = (shm_dir, "decodepng-%u-%s-" % (os.getpid(),
+                                          binascii.hexlify(os.urandom(4))))
+
+  tasks = [(fname, out_dir, out_format, shm) for fname in fnames]
+  pool = multiprocessing.Pool(processes)
+  results = []
+  completed = False
+  try:
+    for result in pool.imap(_decode_batch_item, tasks):
+      if callback is not None:
+        callback(result)
+      results.append(result)
+    completed = True
+  finally:
+    if completed:
+      pool.close()
+    else:
+      pool.terminate()
+    pool.join()
+
+    # Po błędzie wyniki nie trafią do wołającego - usuń wszystkie pliki z
+    # pikselami tej paczki (również zapisane przez przerwane procesy).
+    if not completed and shm is not None:
+      shm_dir, shm_prefix = shm
+      for entry in os.listdir(shm_dir):
+        if entry.startswith(shm_prefix):
+          try:
+            os.unlink(os.path.join(shm_dir, entry))
+          except OSError:
+            pass
+
+  return results
+
+# Odwzorowanie w pamięci pikseli wyniku decode_batch (bez out_dir). Plik w
+# pamięci współdzielonej jest od razu usuwany - dane pozostają dostępne do
+# zamknięcia zwróconego obiektu mmap.
+def map_batch_pixels(result):
+  fname = result.pop("shm")
+  try:
+    with open(fname, "rb") as f:
+      return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  finally:
+    os.unlink(fname)
+
+# Lista plików PNG z podanych ścieżek (katalogi nie są przeszukiwane
+# rekurencyjnie).
+def find_png_files(paths):
+  fnames = []
+  for path in paths:
+    if os.path.isdir(path):
+      for entry in sorted(os.listdir(path)):
+        if entry.lower().endswith(".png"):
+          fnames.append(os.path.join(path, entry))
+    else:
+      fnames.append(path)
+  return fnames
+
+def batch_main(argv):
+  try:
+    opts, paths = getopt(argv, "j:o:f:")
+  except GetoptError as e:
+    paths = []
+
+  if not paths:
+    print "usage: decodepng.py [-j procs] [-o out_dir] [-f raw|bmp] " \
+          "<file.png|dir> ..."
+    sys.exit(1)
+
+  opts = dict(opts)
+  processes = int(opts["-j"]) if "-j" in opts else None
+  out_dir = opts.get("-o")
+  out_format = opts.get("-f", "raw")
+
+  def report(result):
+    if result["error"] is not None:
+      print "[ ERROR ] %s (%.3f s): %s" % (result["fname"], result["time"],
+                                           result["error"])
+    else:
+      print "[  OK   ] %s (%.3f s): %ux%u %s" % (
+          result["fname"], result["time"], result["width"],
+          result["height"], result["format"])
+
+  # Bez -o pliki są tylko dekodowane (np. w celu sprawdzenia poprawności lub
+  # pomiaru czasu) - piksele nie są zachowywane.
+  start = time.time()
+  results = decode_batch(find_png_files(paths), out_dir, out_format,
+                         processes, report, keep_pixels=False)
+  errors = len([r for r in results if r["error"] is not None])
+  print "%u files, %u errors, %.3f s" % (len(results), errors,
+                                         time.time() - start)
+  if errors:
+    sys.exit(2)
+
+
 def main():
+  # Z argumentami: dekodowanie wielu plików naraz.
+  if len(sys.argv) > 1:
+    batch_main(sys.argv[1:])
+    return
+
   png = PNGReader("test.png")
   b = png.decode()
 
   # Zapisz dane jako surową bitmapę.
   with open("dump.raw", "wb") as f:
-    for row in b["rgb"]:
-      f.write(''.join(map(chr, row)))
+    f.write(b["pixels"])
 
 
 if __name__ == "__main__":
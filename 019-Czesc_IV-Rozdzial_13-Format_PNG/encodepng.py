@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+from struct import pack
+from zlib import (adler32, compressobj, crc32, DEFLATED, Z_FINISH,
+                  Z_SYNC_FLUSH)
+import time
+
+from decodepng import PNG_HEADER, PNGError, PNGReader
+
+# NumPy jest opcjonalny - bez niego filtry są liczone na typie bytearray.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Typy kolorów PNG dla formatów bitmapy zwracanych przez PNGReader.
+FORMAT_COLOR_TYPES = {
+    "L": 0,
+    "RGB": 2,
+    "LA": 4,
+    "RGBA": 6,
+    }
+
+# Połączenie sum kontrolnych Adler-32 dwóch sąsiednich fragmentów danych
+# (odpowiednik adler32_combine z biblioteki zlib, której moduł zlib w
+# Pythonie nie udostępnia). len2 to długość drugiego fragmentu.
+def adler32_combine(adler1, adler2, len2):
+  BASE = 65521
+  rem = len2 % BASE
+  sum1 = adler1 & 0xffff
+  sum2 = (rem * sum1) % BASE
+  sum1 += (adler2 & 0xffff) + BASE - 1
+  sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + BASE - rem
+  return ((sum2 % BASE) << 16) | (sum1 % BASE)
+
+class PNGWriter:
+  # Parametry:
+  # - level - poziom kompresji zlib (0-9),
+  # - filter_type - stały filtr dla wszystkich wierszy (0-4) lub None, czyli
+  #   wybór filtra dla każdego wiersza osobno (heurystyka minimalnej sumy
+  #   wartości bezwzględnych przefiltrowanych bajtów, traktowanych jako
+  #   liczby ze znakiem - zalecana w dokumentacji PNG),
+  # - threads - liczba wątków kompresujących; zlib zwalnia GIL na czas
+  #   kompresji, więc wątki faktycznie działają równolegle,
+  # - segment_size - przybliżona wielkość (w bajtach) fragmentu bitmapy
+  #   kompresowanego niezależnie przez pojedynczy wątek.
+  def __init__(self, fname, level=6, filter_type=None, threads=1,
+               segment_size=1 << 20):
+    self.fname = fname
+    self.level = level
+    self.filter_type = filter_type
+    self.threads = threads
+    self.segment_size = segment_size
+    self.png = None
+
+  def _write_chunk(self, chunk_type, data):
+    crc = crc32(data, crc32(chunk_type)) & 0xffffffff
+    self.png.write(pack(">I", len(data)))
+    self.png.write(chunk_type)
+    self.png.write(data)
+    self.png.write(pack(">I", crc))
+
+  def _write_IHDR(self):
+    self._write_chunk("IHDR", pack(">IIBBBBB", self.width, self.height,
+                                   self.depth, self.color, 0, 0, 0))
+
+  def _write_tRNS(self, transparent):
+    # Przezroczysty kolor dla skali szarości i RGB (16-bitowe próbki).
+    self._write_chunk("tRNS", pack(">%uH" % len(transparent), *transparent))
+
+  # Implementacja filtrów wg. dokumentacji PNG.
+  # W przeciwieństwie do dekodera wszystkie wartości (lewy, górny i
+  # lewy-górny bajt) są znane z góry, więc z NumPy wszystkie pięć filtrów
+  # jest liczonych naraz dla całego fragmentu bitmapy. Wynikiem są wiersze
+  # poprzedzone bajtem z numerem wybranego filtra.
+  def _filter_rows_numpy(self, rows, prior):
+    bpp = self.bpp
+    x = rows.astype(numpy.int16)
+    b = numpy.empty_like(x)
+    b[0] = prior
+    b[1:] = x[:-1]
+    a = numpy.zeros_like(x)
+    a[:, bpp:] = x[:, :-bpp]
+    c = numpy.zeros_like(x)
+    c[:, bpp:] = b[:, :-bpp]
+
+    p = a + b - c
+    pa = numpy.abs(p - a)
+    pb = numpy.abs(p - b)
+    pc = numpy.abs(p - c)
+    paeth = numpy.where((pa <= pb) & (pa <= pc), a,
+                        numpy.where(pb <= pc, b, c))
+
+    candidates = numpy.array([x, x - a, x - b, x - ((a + b) >> 1), x - paeth])
+    candidates = (candidates & 0xff).astype(numpy.uint8)
+
+    n = len(rows)
+    if self.filter_type is None:
+      scores = numpy.abs(candidates.view(numpy.int8).astype(numpy.int32))
+      choice = numpy.argmin(scores.sum(axis=2), axis=0)
+    else:
+      choice = numpy.empty(n, dtype=numpy.intp)
+      choice.fill(self.filter_type)
+
+    out = numpy.empty((n, self.row_size + 1), dtype=numpy.uint8)
+    out[:, 0] = choice
+    out[:, 1:] = candidates[choice, numpy.arange(n)]
+    return out.tostring()
+
+  def _filter_row(self, filter_type, row, prior):
+    bpp = self.bpp
+    left = bytearray(bpp) + row[:-bpp]
+    if filter_type == 0:
+      return row
+    if filter_type == 1:
+      return bytearray([(x - a) & 0xff for x, a in izip(row, left)])
+    if filter_type == 2:
+      return bytearray([(x - b) & 0xff for x, b in izip(row, prior)])
+    if filter_type == 3:
+      return bytearray([(x - ((a + b) >> 1)) & 0xff
+                        for x, a, b in izip(row, left, prior)])
+
+    out = bytearray()
+    for x, a, b, c in izip(row, left, prior, bytearray(bpp) + prior[:-bpp]):
+      p = a + b - c
+      pa = abs(p - a)
+      pb = abs(p - b)
+      pc = abs(p - c)
+      if pa <= pb and pa <= pc:
+        out.append((x - a) & 0xff)
+      elif pb <= pc:
+        out.append((x - b) & 0xff)
+      else:
+        out.append((x - c) & 0xff)
+    return out
+
+  def _filter_rows_bytearray(self, rows, prior):
+    out = bytearray()
+    for row in rows:
+      if self.filter_type is not None:
+        best_type = self.filter_type
+        best = self._filter_row(best_type, row, prior)
+      else:
+        best_score = None
+        for filter_type in xrange(5):
+          filtered = self._filter_row(filter_type, row, prior)
+          score = sum([v if v < 128 else 256 - v for v in filtered])
+          if best_score is None or score < best_score:
+            best_type, best, best_score = filter_type, filtered, score
+      out.append(best_type)
+      out.extend(best)
+      prior = row
+    return str(out)
+  # Koniec filtrów.
+
+  def _filter_segment(self, segment):
+    # Przefiltruj wiersze od y0 do y1 (bez y1). Poprzedni wiersz jest brany
+    # wprost z bitmapy, więc fragmenty można filtrować niezależnie.
+    y0, y1 = segment
+    stride = self.stride
+    if numpy is not None:
+      rows = self.pixels_view[y0 * stride:y1 * stride]
+      rows = rows.reshape(y1 - y0, stride)[:, :self.row_size]
+      if y0 == 0:
+        prior = numpy.zeros(self.row_size, dtype=numpy.uint8)
+      else:
+        prior = self.pixels_view[(y0 - 1) * stride:][:self.row_size]
+      return self._filter_rows_numpy(rows, prior)
+
+    rows = [bytearray(self.pixels[y * stride:y * stride + self.row_size])
+            for y in xrange(y0, y1)]
+    if y0 == 0:
+      prior = bytearray(self.row_size)
+    else:
+      prior = bytearray(self.pixels[(y0 - 1) * stride:
+                                    (y0 - 1) * stride + self.row_size])
+    return self._filter_rows_bytearray(rows, prior)
+
+  def _compress_segment(self, segment):
+    # Każdy fragment to osobny strumień deflate (bez nagłówka zlib)
+    # zakończony Z_SYNC_FLUSH - kończy się on na granicy bajtu i nie zawiera
+    # bloku oznaczonego jako ostatni, więc kolejne fragmenty można po prostu
+    # skleić. Tylko ostatni fragment jest zamykany przez Z_FINISH.
+    data = self._filter_segment(segment)
+    deflater = compressobj(self.level, DEFLATED, -15)
+    last = segment[1] == self.height
+    compressed = deflater.compress(data)
+    compressed += deflater.flush(Z_FINISH if last else Z_SYNC_FLUSH)
+    return compressed, adler32(data) & 0xffffffff, len(data)
+
+  def _zlib_header(self):
+    # CMF: metoda deflate z oknem 32 KB; FLG: poziom kompresji i bity
+    # kontrolne, tak by CMF * 256 + FLG było podzielne przez 31.
+    cmf = 0x78
+    flevel = 0 if self.level < 2 else 1 if self.level < 6 else \
+             2 if self.level == 6 else 3
+    flg = flevel << 6
+    flg += (31 - (cmf * 256 + flg) % 31) % 31
+    return chr(cmf) + chr(flg)
+
+  def _write_bitmap_data(self):
+    rows_per_segment = max(1, self.segment_size / (self.row_size + 1))
+    segments = [(y, min(y + rows_per_segment, self.height))
+                for y in xrange(0, self.height, rows_per_segment)]
+
+    if self.threads > 1 and len(segments) > 1:
+      # Fragmenty są filtrowane i kompresowane równolegle, a następnie
+      # zapisywane (w kolejności) jako osobne bloki IDAT.
+      pool = ThreadPool(self.threads)
+      try:
+        self._write_segments(pool.imap(self._compress_segment, segments))
+      finally:
+        pool.close()
+        pool.join()
+      return
+
+    # Jeden wątek: jeden wspólny strumień deflate dla całej bitmapy.
+    deflater = compressobj(self.level, DEFLATED, -15)
+    def compress_segments():
+      for segment in segments:
+        data = self._filter_segment(segment)
+        compressed = deflater.compress(data)
+        if segment[1] == self.height:
+          compressed += deflater.flush(Z_FINISH)
+        yield compressed, adler32(data) & 0xffffffff, len(data)
+    self._write_segments(compress_segments())
+
+  def _write_segments(self, segments):
+    # Nagłówek zlib trafia do pierwszego bloku IDAT, a suma Adler-32 całości
+    # (wyliczona z sum poszczególnych fragmentów) - na koniec ostatniego.
+    pending = self._zlib_header()
+    checksum = 1
+    for compressed, segment_checksum, length in segments:
+      checksum = adler32_combine(checksum, segment_checksum, length)
+      pending += compressed
+      if len(pending) >= self.segment_size / 4:
+        self._write_chunk("IDAT", pending)
+        pending = ""
+    self._write_chunk("IDAT", pending + pack(">I", checksum))
+
+  def encode(self, bitmap):
+    # Bitmapa w formacie zwracanym przez PNGReader.decode.
+    if bitmap["format"] not in FORMAT_COLOR_TYPES:
+      raise PNGError("unsupported format (%s)" % bitmap["format"])
+    if bitmap["depth"] not in (8, 16):
+      raise PNGError("unsupported depth (%u)" % bitmap["depth"])
+
+    self.width = bitmap["width"]
+    self.height = bitmap["height"]
+    self.depth = bitmap["depth"]
+    self.color = FORMAT_COLOR_TYPES[bitmap["format"]]
+    self.bpp = len(bitmap["format"]) * self.depth / 8
+    self.row_size = self.width * self.bpp
+    self.stride = bitmap["stride"]
+    self.pixels = bitmap["pixels"]
+    if numpy is not None:
+      self.pixels_view = numpy.frombuffer(self.pixels, dtype=numpy.uint8)
+
+    with open(self.fname, "wb") as f:
+      self.png = f
+      f.write(PNG_HEADER)
+      self._write_IHDR()
+      if bitmap.get("transparent") is not None:
+        self._write_tRNS(bitmap["transparent"])
+      self._write_bitmap_data()
+      self._write_chunk("IEND", "")
+
+
+def main():
+  # Odczytaj test.png i zapisz go ponownie z różnymi ustawieniami.
+  bitmap = PNGReader("test.png").decode()
+  for level, threads in ((6, 1), (9, 1), (9, 4)):
+    fname = "test_out_%u_%u.png" % (level, threads)
+    start = time.time()
+    PNGWriter(fname, level=level, threads=threads).encode(bitmap)
+    elapsed = time.time() - start
+
+    check = PNGReader(fname).decode()
+    print "%s: %.3f s, %s" % (
+        fname, elapsed,
+        "OK" if check["pixels"] == bitmap["pixels"] else "MISMATCH")
+
+
+if __name__ == "__main__":
+  main()
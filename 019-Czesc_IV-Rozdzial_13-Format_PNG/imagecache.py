@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from array import array
+from collections import OrderedDict
+from threading import Lock
+import mmap
+import os
+import tempfile
+import time
+
+from decodepng import PNGReader
+
+from loadimage import Bitmap, load_image
+
+# Dekoder BMP z poprzedniego rozdziału (katalog dodany do sys.path przez
+# loadimage).
+from loadbmp import MyLoadBMP
+
+# Pamięć podręczna zdekodowanych obrazów. Podobnie jak file_cache w
+# httpchat.py, wpisy są identyfikowane nazwą pliku i unieważniane, gdy plik
+# się zmieni (inny czas modyfikacji lub rozmiar), ale w przeciwieństwie do
+# niego ilość zajmowanej pamięci jest ograniczona - po przekroczeniu budżetu
+# usuwane są najdawniej używane obrazy (LRU).
+#
+# Obraz to wynik dowolnej funkcji wczytującej (loader), o ile jest to:
+# - bitmapa w formacie zwracanym przez PNGReader.decode (słownik z polem
+#   "pixels"),
+# - obiekt Bitmap zwracany przez load_image, lub
+# - krotka, której ostatnim elementem są piksele - tak jak (w, h, bpp,
+#   array('B')) zwracane przez MyLoadBMP z rozdziału o formacie BMP.
+#
+# Jeśli podano katalog spill_dir, obrazy usuwane z pamięci trafiają do
+# plików z surowymi pikselami i przy kolejnym użyciu są mapowane do pamięci
+# (mmap) zamiast ponownie dekodowane. Piksele bitmap odczytanych w ten
+# sposób są obiektem mmap (tylko do odczytu), a piksele w postaci array są
+# kopiowane do nowej tablicy.
+#
+# Uwaga: Zwracane obrazy są współdzielone między wywołaniami, więc nie należy
+# ich modyfikować.
+class ImageCache:
+  def __init__(self, budget=256 << 20, spill_dir=None, spill_budget=1 << 30):
+    self.budget = budget
+    self.spill_dir = spill_dir
+    self.spill_budget = spill_budget
+    self.lock = Lock()
+
+    # Kolejność wpisów w OrderedDict to kolejność użycia - od najdawniej
+    # używanego. Wpis: (mtime, size, obraz, rozmiar pikseli w bajtach).
+    self.entries = OrderedDict()
+    self.used = 0
+
+    # Obrazy zrzucone na dysk. Wpis: (mtime, size, obraz bez pikseli, nazwa
+    # pliku z pikselami, rozmiar pikseli w bajtach, mmap lub None).
+    self.spilled = OrderedDict()
+    self.spill_used = 0
+
+    self.stats = { "hits": 0, "spill_hits": 0, "misses": 0, "evictions": 0 }
+
+  def load(self, fname, loader):
+    # Zwraca obraz z pamięci podręcznej lub wczytuje go przy pomocy funkcji
+    # loader(fname). Jeśli loader zwróci None (np. MyLoadBMP dla
+    # nieobsługiwanego pliku), zwracane jest None, a nic nie jest
+    # zapamiętywane.
+    st = os.stat(fname)
+    mtime, size = st.st_mtime, st.st_size
+
+    with self.lock:
+      entry = self.entries.get(fname)
+      if entry is not None and entry[:2] == (mtime, size):
+        # Przenieś wpis na koniec kolejki (ostatnio używany).
+        del self.entries[fname]
+        self.entries[fname] = entry
+        self.stats["hits"] += 1
+        return entry[2]
+
+      image = self._load_spilled(fname, mtime, size)
+      if image is not None:
+        self.stats["spill_hits"] += 1
+        return image
+
+    # Dekodowanie odbywa się poza blokadą, więc inne wątki mogą w tym czasie
+    # korzystać z pamięci podręcznej.
+    image = loader(fname)
+    if image is None:
+      return None
+
+    with self.lock:
+      self.stats["misses"] += 1
+      entry = self.entries.get(fname)
+      if entry is None or entry[0] <= mtime:
+        self._discard(fname)
+        nbytes = _pixels_size(_get_pixels(image))
+        self.entries[fname] = (mtime, size, image, nbytes)
+        self.used += nbytes
+        self._evict()
+    return image
+
+  def clear(self):
+    # Usuwa wszystkie wpisy, łącznie z plikami zrzuconymi na dysk.
+    with self.lock:
+      for fname in list(self.entries):
+        self._discard(fname)
+      for fname in list(self.spilled):
+        self._discard_spilled(fname)
+
+  def _discard(self, fname):
+    if fname in self.entries:
+      self.used -= self.entries.pop(fname)[3]
+    if fname in self.spilled:
+      self._discard_spilled(fname)
+
+  def _evict(self):
+    # Pojedynczy obraz większy niż cały budżet również jest usuwany - zostanie
+    # zwrócony wywołującemu, ale nie jest zapamiętywany.
+    while self.used > self.budget and self.entries:
+      fname, (mtime, size, image, nbytes) = self.entries.popitem(last=False)
+      self.used -= nbytes
+      self.stats["evictions"] += 1
+      if self.spill_dir is not None:
+        self._spill(fname, mtime, size, image, nbytes)
+
+  def _spill(self, fname, mtime, size, image, nbytes):
+    if nbytes == 0 or nbytes > self.spill_budget:
+      return
+
+    pixels = _get_pixels(image)
+    fd, spill_fname = tempfile.mkstemp(suffix=".raw", dir=self.spill_dir)
+    with os.fdopen(fd, "wb") as f:
+      f.write(pixels)
+
+    self.spilled[fname] = (mtime, size, _set_pixels(image, None),
+                           spill_fname, nbytes, None)
+    self.spill_used += nbytes
+    while self.spill_used > self.spill_budget:
+      self._discard_spilled(next(iter(self.spilled)))
+
+  def _load_spilled(self, fname, mtime, size):
+    entry = self.spilled.get(fname)
+    if entry is None:
+      return None
+    if entry[:2] != (mtime, size):
+      self._discard_spilled(fname)
+      return None
+
+    meta, spill_fname, nbytes, pixels = entry[2:]
+    if pixels is None:
+      with open(spill_fname, "rb") as f:
+        pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    del self.spilled[fname]
+    self.spilled[fname] = (mtime, size, meta, spill_fname, nbytes, pixels)
+
+    if isinstance(_get_pixels(meta), array):
+      copy = array(_get_pixels(meta).typecode)
+      copy.fromstring(pixels[:])
+      return _set_pixels(meta, copy)
+    return _set_pixels(meta, pixels)
+
+  def _discard_spilled(self, fname):
+    # Zmapowane piksele pozostają ważne także po usunięciu pliku, więc obrazy
+    # zwrócone wcześniej nie przestają działać.
+    entry = self.spilled.pop(fname)
+    self.spill_used -= entry[4]
+    try:
+      os.unlink(entry[3])
+    except OSError:
+      pass
+
+
+# Dostęp do pikseli obrazu we wszystkich obsługiwanych postaciach (patrz
+# opis klasy ImageCache). Obraz zrzucony na dysk zamiast pikseli przechowuje
+# pustą tablicę tego samego typu (lub None dla pikseli w innej postaci).
+def _get_pixels(image):
+  if isinstance(image, dict):
+    return image["pixels"]
+  if isinstance(image, Bitmap):
+    return image.pixels
+  return image[-1]
+
+def _set_pixels(image, pixels):
+  if isinstance(image, dict):
+    image = dict(image)
+    image["pixels"] = pixels
+    return image
+  if pixels is None and isinstance(_get_pixels(image), array):
+    pixels = array(_get_pixels(image).typecode)
+  if isinstance(image, Bitmap):
+    return Bitmap(image.width, image.height, image.format, image.depth,
+                  image.stride, pixels, image.orientation, image.transparent)
+  return image[:-1] + (pixels,)
+
+def _pixels_size(pixels):
+  if isinstance(pixels, array):
+    return len(pixels) * pixels.itemsize
+  return len(pixels)
+
+
+# Wspólna pamięć podręczna dla decode_png, decode_bmp i decode_image.
+default_cache = ImageCache()
+
+def decode_png(fname, cache=None):
+  # Odpowiednik PNGReader(fname).decode() korzystający z pamięci podręcznej.
+  if cache is None:
+    cache = default_cache
+  return cache.load(fname, lambda fname: PNGReader(fname).decode())
+
+def decode_bmp(fname, cache=None):
+  # Odpowiednik MyLoadBMP(fname) korzystający z pamięci podręcznej.
+  if cache is None:
+    cache = default_cache
+  return cache.load(fname, MyLoadBMP)
+
+def decode_image(fname, cache=None):
+  # Odpowiednik load_image(fname) korzystający z pamięci podręcznej.
+  if cache is None:
+    cache = default_cache
+  return cache.load(fname, load_image)
+
+
+def main():
+  # Dekoduj test.png kilka razy - tylko pierwsze dekodowanie powinno trwać.
+  cache = ImageCache()
+  for i in xrange(3):
+    start = time.time()
+    bitmap = decode_png("test.png", cache)
+    print "test.png: %ux%u, %.3f s" % (bitmap["width"], bitmap["height"],
+                                      time.time() - start)
+  print cache.stats
+
+  # Bez budżetu w pamięci obraz od razu trafia na dysk.
+  cache = ImageCache(budget=0, spill_dir=tempfile.gettempdir())
+  decode_png("test.png", cache)
+  check = decode_png("test.png", cache)
+  print "spilled: %s" % (
+      "OK" if check["pixels"][:] == bitmap["pixels"] else "MISMATCH")
+  print cache.stats
+  cache.clear()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+from decodepng import PNG_HEADER, PNGReader
+
+# Dekoder BMP jest w katalogu poprzedniego rozdziału.
+BMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                       "018-Czesc_IV-Rozdzial_12-Format_BMP_i_wstep_do_bitmap")
+sys.path.append(BMP_DIR)
+from loadbmp import BI_RGB, BI_RLE8, decode_rle8, parse_bmp_header
+
+
+class ImageError(Exception):
+  pass
+
+# Zdekodowany obraz niezależnie od formatu pliku. Piksele to jeden ciągły
+# bufor (pixels), a pozostałe pola opisują jak go interpretować:
+# - format - kolejność kanałów w pikselu: "L", "LA", "RGB", "RGBA" (PNG) lub
+#   "BGR" (BMP),
+# - depth - liczba bitów na kanał (8 lub 16; 16-bitowe wartości są zapisane
+#   big-endian, tak jak w PNG),
+# - stride - odległość (w bajtach) między początkami kolejnych wierszy w
+#   buforze; może być większa niż długość wiersza (np. padding w BMP),
+# - orientation - kolejność wierszy w buforze: "top-down" lub "bottom-up",
+# - transparent - przezroczysty kolor (patrz PNGReader) lub None.
+# Dzięki polom stride i orientation bufor może pochodzić wprost z pliku, bez
+# konwersji do jednego, wspólnego układu.
+class Bitmap(object):
+  __slots__ = ("width", "height", "format", "depth", "stride", "orientation",
+               "transparent", "pixels")
+
+  def __init__(self, width, height, format, depth, stride, pixels,
+               orientation="top-down", transparent=None):
+    self.width = width
+    self.height = height
+    self.format = format
+    self.depth = depth
+    self.stride = stride
+    self.orientation = orientation
+    self.transparent = transparent
+    self.pixels = pixels
+
+  @property
+  def pixel_size(self):
+    return len(self.format) * self.depth / 8
+
+  @property
+  def row_size(self):
+    return self.width * self.pixel_size
+
+  def row_offset(self, y):
+    # Położenie w buforze wiersza y (licząc od góry obrazu).
+    if self.orientation == "bottom-up":
+      y = self.height - 1 - y
+    return y * self.stride
+
+  def row(self, y):
+    # Widok na piksele wiersza y (licząc od góry obrazu), bez paddingu i bez
+    # kopiowania danych. Obiekty bez nowego interfejsu bufora (np. mmap w
+    # Pythonie 2, patrz ImageCache) dają widok przez buffer.
+    offset = self.row_offset(y)
+    try:
+      return memoryview(self.pixels)[offset:offset + self.row_size]
+    except TypeError:
+      return buffer(self.pixels, offset, self.row_size)
+
+  def __repr__(self):
+    return "<Bitmap %ux%u %s/%u stride=%u %s>" % (
+        self.width, self.height, self.format, self.depth, self.stride,
+        self.orientation)
+
+
+def _load_png(fname):
+  bitmap = PNGReader(fname).decode()
+  return Bitmap(bitmap["width"], bitmap["height"], bitmap["format"],
+                bitmap["depth"], bitmap["stride"], bitmap["pixels"],
+                transparent=bitmap["transparent"])
+
+def _load_bmp(fname):
+  with open(fname, "rb") as f:
+    header = parse_bmp_header(f.read(14 + 40))
+    if header is None:
+      raise ImageError("unsupported BMP file")
+
+    w, h = header["width"], header["height"]
+    orientation = "bottom-up" if h > 0 else "top-down"
+    if header["bpp"] == 24 and header["compression"] == BI_RGB:
+      # Piksele trafiają do bufora prosto z pliku - wiersze zostają w
+      # kolejności z pliku i z paddingiem (stride to pitch).
+      pitch = (w * 3 + 3) & ~3
+      pixels = bytearray(pitch * abs(h))
+      f.seek(header["offset"])
+      if f.readinto(pixels) != len(pixels):
+        raise ImageError("truncated BMP file")
+      return Bitmap(w, abs(h), "BGR", 8, pitch, pixels, orientation)
+
+    if header["bpp"] == 8 and header["compression"] == BI_RLE8:
+      f.seek(0)
+      pixels = decode_rle8(f.read(), header["offset"], w, h,
+                           header["clr_used"])
+      return Bitmap(w, abs(h), "BGR", 8, w * 3, pixels)
+
+  raise ImageError("unsupported BMP encoding")
+
+
+# Rozpoznawanie formatu pliku po jego początkowych bajtach (magic). Kolejne
+# formaty można dodać przez register_loader - funkcja wczytująca dostaje
+# nazwę pliku i zwraca obiekt Bitmap.
+LOADERS = [
+    (PNG_HEADER, _load_png),
+    ("BM", _load_bmp),
+    ]
+
+def register_loader(magic, loader):
+  LOADERS.append((magic, loader))
+
+def load_image(fname):
+  with open(fname, "rb") as f:
+    magic = f.read(max(len(m) for m, loader in LOADERS))
+
+  for m, loader in LOADERS:
+    if magic.startswith(m):
+      return loader(fname)
+
+  raise ImageError("unknown image format")
+
+
+def main():
+  for fname in sys.argv[1:] or ["test.png",
+                                os.path.join(BMP_DIR, "test.bmp"),
+                                os.path.join(BMP_DIR, "test8rle.bmp")]:
+    try:
+      print "%s: %r" % (fname, load_image(fname))
+    except (ImageError, IOError) as e:
+      print "%s: %s" % (fname, e)
+
+
+if __name__ == "__main__":
+  main()
@@ -7,13 +7,25 @@
 # wersją interpretera ma do czynienia i wybiera odpowiednią wersję kodu do
 # wykonania.
 import os
+import errno
 import json
+import select
 import sys
 import socket
+import time
 from threading import Event, Lock, Thread
+try:
+  from queue import Queue
+except ImportError:
+  from Queue import Queue  # Python 2.
 
 DEBUG = False  # Zmiana na True powdouje wyświetlenie dodatkowych komunikatów.
 
+# Połączenia trwałe (keep-alive): jak długo połączenie może czekać na kolejne
+# zapytanie i ile zapytań można wysłać jednym połączeniem.
+KEEPALIVE_TIMEOUT = 15
+KEEPALIVE_MAX_REQUESTS = 100
+
 # Implementacja logiki strony WWW.
 class SimpleChatWWW():
   def __init__(self, the_end):
@@ -188,202 +200,614 @@ class ClientThread(Thread):
     self.s = sock
     self.s_addr = sock_addr
     self.website = website
+    self.reader = HTTPRequestReader(sock_addr)
 
-  def __recv_http_request(self):
-    # Bardzo uproszczony parsing zapytania HTTP, którego głównym celem jest
-    # wydobycie:
-    # - metody
-    # - żądanej ścieżki
-    # - kolejnych parametrów w formie słownika
-    # - dodatkowych danych (w przypadku POST)
-
-    # Odbierz dane aż do zakończenia nagłówka.
-    data = recvuntil(self.s, '\r\n\r\n')
-    if not data:
-      return None
+  def __send_http_response(self, response, keep_alive=False):
+    self.s.sendall(build_http_response(response, keep_alive))
 
-    # Podziel na linie.
-    lines = data.split('\r\n')
+  def __handle_client(self, last):
+    # Obsłuż jedno zapytanie. Zwraca True, jeśli połączenie ma zostać
+    # utrzymane dla kolejnego zapytania.
+    try:
+      request = self.reader.receive(self.s)
+    except HTTPRequestError as e:
+      if DEBUG:
+        sys.stdout.write("[WARNING] Client %s:%i sent an invalid request (%s). "
+                         "Disconnecting.\n" % (self.s_addr + (e,)))
+      self.__send_http_response({ 'status': e.status })
+      return False
 
-    # Przeanalizuj zapytanie (pierwsza linia).
-    query_tokens = lines.pop(0).split(' ')
-    if len(query_tokens) != 3:
-      return None
+    if not request:
+      if DEBUG and not self.reader.empty():
+        sys.stdout.write("[WARNING] Client %s:%i doesn't make any sense. "
+                         "Disconnecting.\n" % self.s_addr)
+      return False
+
+    if DEBUG:
+      sys.stdout.write("[  INFO ] Client %s:%i requested %s\n" % (
+          self.s_addr[0], self.s_addr[1], request['query']))
+    keep_alive = not last and wants_keep_alive(request, self.reader)
+    response = self.website.handle_http_request(request)
+    self.__send_http_response(response, keep_alive)
+    return keep_alive
+
+  def run(self):
+    try:
+      for i in range(KEEPALIVE_MAX_REQUESTS):
+        # Operacje nie powinny zajmować dłużej niż 5 sekund, ale na kolejne
+        # zapytanie (jeśli nie zostało już odebrane) można czekać dłużej.
+        if i > 0 and self.reader.empty():
+          self.s.settimeout(KEEPALIVE_TIMEOUT)
+        else:
+          self.s.settimeout(5)
+        if not self.__handle_client(i == KEEPALIVE_MAX_REQUESTS - 1):
+          break
+    except socket.timeout as e:
+      if DEBUG:
+        sys.stdout.write("[WARNING] Client %s:%i timed out. "
+                         "Disconnecting.\n" % self.s_addr)
+    except socket.error as e:
+      pass  # Klient się rozłączył.
+    try:
+      self.s.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass  # Klient mógł się już rozłączyć.
+    self.s.close()
 
-    method, query, version = query_tokens
 
-    # Wczytaj parametry.
-    headers = {}
+# Przeanalizuj nagłówek zapytania HTTP (bez kończącej go pustej linii).
+# Zwraca krotkę (metoda, ścieżka, wersja protokołu, słownik z parametrami)
+# lub None.
+def parse_http_header(data):
+  # Podziel na linie.
+  lines = data.split('\r\n')
+
+  # Przeanalizuj zapytanie (pierwsza linia).
+  query_tokens = lines.pop(0).split(' ')
+  if len(query_tokens) != 3:
+    return None
+
+  method, query, version = query_tokens
+
+  # Wczytaj parametry.
+  headers = {}
+  for line in lines:
+    tokens = line.split(':', 1)
+    if len(tokens) != 2:
+      continue
+    # Nazwa nagłówka jest case-insensitive, więc warto ją znormalizować, np.
+    # zmieniając wszystkie litery na małe.
+    header_name = tokens[0].strip().lower()
+    header_value = tokens[1].strip()
+    headers[header_name] = header_value
+
+  return method, query, version, headers
+
+
+# Skonstruuj odpowiedź HTTP (jako bajty) ze słownika zwróconego przez
+# SimpleChatWWW.handle_http_request. keep_alive mówi, czy po odpowiedzi
+# połączenie zostanie utrzymane.
+def build_http_response(response, keep_alive=False):
+  lines = []
+  lines.append('HTTP/1.1 %u %s' % response['status'])
+
+  # Ustaw podstawowe pola.
+  lines.append('Server: example')
+  if 'data' in response:
+    lines.append('Content-Length: %u' % len(response['data']))
+  else:
+    lines.append('Content-Length: 0')
+  lines.append('Connection: %s' % ('keep-alive' if keep_alive else 'close'))
+
+  # Przepisz nagłówki.
+  if 'headers' in response:
+    for header in response['headers']:
+      lines.append('%s: %s' % header)
+  lines.append('')
+
+  # Przepisz dane (lub dodaj pustą linię kończącą nagłówek). Po odpowiedzi
+  # może nastąpić kolejna, więc nagłówek musi być poprawnie zakończony.
+  lines.append(response.get('data', ''))
+  
+  # Ew. skonwertuj odpowiedź na bajty.
+  if sys.version_info.major == 3:    
+    converted_lines = []
     for line in lines:
-      tokens = line.split(':', 1)
-      if len(tokens) != 2:
-        continue
-      # Nazwa nagłówka jest case-insensitive, więc warto ją znormalizować, np.
-      # zmieniając wszystkie litery na małe.
-      header_name = tokens[0].strip().lower()
-      header_value = tokens[1].strip()
-      headers[header_name] = header_value
-
-    # W przypadku metody POST pobierz dodatkowe dane.
-    # Uwaga: przykładowa implementacja w żaden sposób nie limituje ilości
-    # przesyłanych danych.
-    if method == 'POST':
+      if type(line) is bytes:
+        converted_lines.append(line)
+      else:
+        converted_lines.append(bytes(line, 'utf-8'))
+    lines = converted_lines
+  
+  return b'\r\n'.join(lines)
+
+
+class HTTPRequestError(Exception):
+  def __init__(self, status):
+    super(HTTPRequestError, self).__init__('%u %s' % status)
+    self.status = status  # Status odpowiedzi, którą należy odesłać klientowi.
+
+
+# Bufor danych odebranych od klienta, z którego wydzielane są kolejne
+# zapytania HTTP. Dane są odbierane dużymi blokami (a nie bajt po bajcie), a
+# koniec nagłówka jest wyszukiwany w całym buforze jednym wywołaniem find -
+# kolejne wyszukiwanie zaczyna się tam, gdzie skończyło się poprzednie. Dane
+# za końcem zapytania zostają w buforze (np. następne zapytanie).
+#
+# Z bufora korzystają oba serwery: ClientThread wywołuje blokującą metodę
+# receive, a EventServer przekazuje odebrane dane do feed i sprawdza, czy
+# next_request zwraca już całe zapytanie.
+class HTTPRequestReader():
+  MAX_HEADER_SIZE = 16 * 1024
+  MAX_DATA_SIZE = 1024 * 1024
+
+  def __init__(self, sock_addr, max_header_size=MAX_HEADER_SIZE,
+               max_data_size=MAX_DATA_SIZE):
+    self.s_addr = sock_addr
+    self.max_header_size = max_header_size
+    self.max_data_size = max_data_size
+    self.buf = bytearray()
+    self.scanned = 0  # Początek bufora, w którym na pewno nie ma końca nagłówka.
+    self.header = None  # Odebrany nagłówek (patrz parse_http_header).
+    self.eof = False  # Czy klient zakończył wysyłanie danych.
+
+  def feed(self, data):
+    # Pusty blok danych oznacza koniec danych (tak jak w przypadku recv).
+    if data:
+      self.buf += data
+    else:
+      self.eof = True
+
+  def next_request(self):
+    # Zwraca kolejne zapytanie lub None, jeśli nie zostało jeszcze odebrane w
+    # całości. Niepoprawne zapytanie powoduje rzucenie HTTPRequestError.
+    if self.header is None:
+      end = self.buf.find(b'\r\n\r\n', max(0, self.scanned - 3))
+      if end == -1:
+        self.scanned = len(self.buf)
+        end = len(self.buf)
+      if end > self.max_header_size:
+        raise HTTPRequestError((431, 'Request Header Fields Too Large'))
+      if end == len(self.buf):
+        return None
+
+      self.header = parse_http_header(self.__to_str(self.buf[:end]))
+      del self.buf[:end + 4]
+      self.scanned = 0
+      if self.header is None:
+        raise HTTPRequestError((400, 'Bad Request'))
+
+    method, query, version, headers = self.header
+
+    # Kodowanie danych w częściach (Transfer-Encoding: chunked) nie jest
+    # obsługiwane. Takiego zapytania nie można ani odrzucić, ani pominąć bez
+    # odczytania danych, więc połączenie musi zostać zamknięte.
+    if 'transfer-encoding' in headers:
+      raise HTTPRequestError((501, 'Not Implemented'))
+
+    # Pobierz dodatkowe dane - dokładnie tyle bajtów, ile podano w
+    # Content-Length, niezależnie od metody. W przeciwnym wypadku dane
+    # zostałyby potraktowane jako kolejne zapytanie.
+    data = None
+    if 'content-length' in headers:
       try:
         data_length = int(headers['content-length'])
-        data = recv_all(self.s, data_length)
-      except KeyError as e:
-        # Brak Content-Length w nagłówkach.
-        data = recv_remaining(self.s)
-      except ValueError as e:
-        return None      
+      except ValueError:
+        raise HTTPRequestError((400, 'Bad Request'))
+      if data_length < 0:
+        raise HTTPRequestError((400, 'Bad Request'))
+    elif method == 'POST':
+      # Brak Content-Length w nagłówkach - dane aż do rozłączenia.
+      data_length = len(self.buf) if self.eof else None
     else:
-      data = None
+      data_length = 0
+
+    if data_length is None:
+      if len(self.buf) > self.max_data_size:
+        raise HTTPRequestError((413, 'Payload Too Large'))
+      return None
+    if data_length > self.max_data_size:
+      raise HTTPRequestError((413, 'Payload Too Large'))
+    if len(self.buf) < data_length:
+      return None
+
+    if data_length or method == 'POST':
+      data = self.__to_str(self.buf[:data_length])
+      del self.buf[:data_length]
+
+    self.header = None
 
     # Umieść wszystkie istotne dane w słowniku i go zwróć.
-    request = {
+    return {
         "method": method,
         "query": query,
+        "version": version,
         "headers": headers,
         "data": data,
         "client_ip": self.s_addr[0],
         "client_port": self.s_addr[1]
         }
 
-    return request
+  def empty(self):
+    # Czy w buforze nie ma żadnej części kolejnego zapytania.
+    return self.header is None and not self.buf
 
-  def __send_http_response(self, response):
-    # Skonstruuj odpowiedź HTTP.
-    lines = []
-    lines.append('HTTP/1.1 %u %s' % response['status'])
+  def receive(self, sock):
+    # Odbierz (blokująco) kolejne zapytanie. Zwraca None, jeśli klient
+    # rozłączył się wcześniej.
+    while True:
+      request = self.next_request()
+      if request is not None or self.eof:
+        return request
+      self.feed(sock.recv(65536))
 
-    # Ustaw podstawowe pola.
-    lines.append('Server: example')
-    if 'data' in response:
-      lines.append('Content-Length: %u' % len(response['data']))
+  def __to_str(self, data):
+    try:
+      return bytes_to_str(bytes(data))
+    except UnicodeDecodeError:
+      raise HTTPRequestError((400, 'Bad Request'))
+
+
+# Czy klient chce utrzymać połączenie po odpowiedzi na zapytanie? W HTTP/1.1
+# połączenia są domyślnie trwałe (chyba że klient wyśle Connection: close), a
+# w HTTP/1.0 tylko na wyraźne życzenie (Connection: keep-alive). Połączenia
+# nie da się utrzymać, jeśli klient zakończył już wysyłanie danych (np. POST
+# bez Content-Length).
+def wants_keep_alive(request, reader):
+  if reader.eof:
+    return False
+  connection = [token.strip().lower()
+                for token in request['headers'].get('connection', '').split(',')]
+  if request['version'] == 'HTTP/1.0':
+    return 'keep-alive' in connection
+  return 'close' not in connection
+
+
+# Serwer HTTP oparty o zdarzenia. Zamiast osobnego wątku dla każdego
+# połączenia, jeden wątek (pętla zdarzeń) obsługuje wszystkie gniazda w trybie
+# nieblokującym - czeka, aż któreś z nich będzie gotowe do odczytu lub zapisu,
+# i wykonuje tylko te operacje, które nie zablokują. Same zapytania obsługuje
+# (przez SimpleChatWWW.handle_http_request) stała, niewielka pula wątków
+# roboczych, więc liczba wątków nie zależy od liczby połączeń.
+
+# Prosty odpowiednik modułu selectors (którego nie ma w Python 2). Korzysta z
+# epoll (GNU/Linux), poll (większość systemów uniksowych) lub - w
+# ostateczności - select (Windows), który jest ograniczony do kilkuset
+# gniazd.
+class Poller():
+  READ = 0x001  # Wartości takie same jak POLLIN/EPOLLIN
+  WRITE = 0x004  # oraz POLLOUT/EPOLLOUT.
+
+  def __init__(self):
+    self.objects = {}
+    self.events = {}
+    self.timeout_scale = 1
+    if hasattr(select, 'epoll'):
+      self.impl = select.epoll()
+    elif hasattr(select, 'poll'):
+      self.impl = select.poll()
+      self.timeout_scale = 1000  # poll przyjmuje timeout w milisekundach.
+    else:
+      self.impl = None
+
+  def register(self, sock, events, obj):
+    fd = sock.fileno()
+    self.objects[fd] = obj
+    self.events[fd] = events
+    if self.impl is not None:
+      self.impl.register(fd, events)
+
+  def modify(self, sock, events):
+    fd = sock.fileno()
+    if self.events[fd] != events:
+      self.events[fd] = events
+      if self.impl is not None:
+        self.impl.modify(fd, events)
+
+  def unregister(self, sock):
+    fd = sock.fileno()
+    del self.objects[fd]
+    del self.events[fd]
+    if self.impl is not None:
+      self.impl.unregister(fd)
+
+  def poll(self, timeout):
+    # Zwraca listę par (obiekt, zdarzenia) dla gotowych gniazd. Błędy i
+    # rozłączenie są zgłaszane jako gotowość do odczytu (wykryje je recv).
+    if self.impl is None:
+      rlist = [fd for fd, ev in self.events.items() if ev & self.READ]
+      wlist = [fd for fd, ev in self.events.items() if ev & self.WRITE]
+      rlist, wlist, xlist = select.select(rlist, wlist, [], timeout)
+      ready = dict((fd, self.READ) for fd in rlist)
+      for fd in wlist:
+        ready[fd] = ready.get(fd, 0) | self.WRITE
+      ready = ready.items()
     else:
-      lines.append('Content-Length: 0')
+      ready = self.impl.poll(timeout * self.timeout_scale)
+
+    result = []
+    for fd, ev in ready:
+      if fd not in self.objects:
+        continue
+      if ev & ~(self.READ | self.WRITE):
+        ev |= self.READ
+      result.append((self.objects[fd], ev))
+    return result
 
-    # Przepisz nagłówki.
-    if 'headers' in response:
-      for header in response['headers']:
-        lines.append('%s: %s' % header)
-    lines.append('')
 
-    # Przepisz dane.
-    if 'data' in response:
-      lines.append(response['data'])
-    
-    # Ew. skonwertuj odpowiedź na bajty i wyślij.
-    if sys.version_info.major == 3:    
-      converted_lines = []
-      for line in lines:
-        if type(line) is bytes:
-          converted_lines.append(line)
+# Stan jednego połączenia obsługiwanego przez EventServer.
+class EventConnection():
+  def __init__(self, sock, sock_addr):
+    self.s = sock
+    self.s_addr = sock_addr
+    self.reader = HTTPRequestReader(sock_addr)
+    self.outbuf = b''  # Dane do wysłania.
+    self.busy = False  # Czy zapytanie jest obsługiwane przez pulę wątków.
+    self.served = 0  # Liczba zapytań odebranych tym połączeniem.
+    self.closing = False  # Czy zamknąć połączenie po wysłaniu danych.
+    self.closed = False
+    self.last_active = time.time()
+
+
+class EventServer():
+  def __init__(self, website, sock, workers=4, timeout=5,
+               keepalive_timeout=KEEPALIVE_TIMEOUT,
+               max_requests=KEEPALIVE_MAX_REQUESTS):
+    self.website = website
+    self.s = sock
+    # Maksymalny czas bezczynności połączenia - w trakcie przesyłania
+    # zapytania lub odpowiedzi oraz w oczekiwaniu na kolejne zapytanie.
+    self.timeout = timeout
+    self.keepalive_timeout = keepalive_timeout
+    self.max_requests = max_requests
+    self.poller = Poller()
+    self.connections = set()
+    self.accept_paused = False  # Patrz __accept.
+
+    # Zapytania dla wątków roboczych oraz gotowe odpowiedzi. Po dodaniu
+    # odpowiedzi wątek roboczy wysyła bajt przez parę gniazd (wakeup), co
+    # budzi pętlę zdarzeń czekającą w Poller.poll.
+    self.requests = Queue()
+    self.responses = []
+    self.responses_lock = Lock()
+    self.wakeup_r, self.wakeup_w = socketpair()
+    self.wakeup_r.setblocking(0)
+    self.wakeup_w.setblocking(0)
+
+    self.workers = [Thread(target=self.__worker) for i in range(workers)]
+    for worker in self.workers:
+      worker.daemon = True
+      worker.start()
+
+  def serve(self, the_end):
+    self.s.setblocking(0)
+    self.poller.register(self.s, Poller.READ, self.s)
+    self.poller.register(self.wakeup_r, Poller.READ, self.wakeup_r)
+
+    # Poller.poll czeka najwyżej sekundę, dzięki czemu pętla może sprawdzić,
+    # czy serwer został wezwany do zakończenia pracy, oraz rozłączyć
+    # bezczynnych klientów.
+    next_idle_check = time.time()
+    while not the_end.is_set():
+      for obj, events in self.poller.poll(1):
+        if obj is self.s:
+          self.__accept()
+        elif obj is self.wakeup_r:
+          self.__collect_responses()
         else:
-          converted_lines.append(bytes(line, 'utf-8'))
-      lines = converted_lines
-    
-    self.s.sendall(b'\r\n'.join(lines))
+          if events & Poller.READ:
+            self.__on_read(obj)
+          if events & Poller.WRITE and not obj.closed:
+            self.__on_write(obj)
+
+      now = time.time()
+      if now >= next_idle_check:
+        for conn in list(self.connections):
+          if conn.served and conn.reader.empty() and not conn.outbuf:
+            timeout = self.keepalive_timeout
+          else:
+            timeout = self.timeout
+          if not conn.busy and now - conn.last_active > timeout:
+            if DEBUG:
+              sys.stdout.write("[WARNING] Client %s:%i timed out. "
+                               "Disconnecting.\n" % conn.s_addr)
+            self.__close(conn)
+        next_idle_check = now + 1
+
+        if self.accept_paused:
+          self.poller.modify(self.s, Poller.READ)
+          self.accept_paused = False
+
+    for conn in list(self.connections):
+      self.__close(conn)
+    for worker in self.workers:
+      self.requests.put(None)
+
+  def __worker(self):
+    while True:
+      item = self.requests.get()
+      if item is None:
+        return
+      conn, request, keep_alive = item
+      try:
+        response = self.website.handle_http_request(request)
+      except Exception as e:
+        if DEBUG:
+          sys.stdout.write("[WARNING] Request %s failed: %s\n" % (
+              request['query'], e))
+        response = { 'status': (500, 'Internal Server Error') }
+
+      with self.responses_lock:
+        self.responses.append((conn, build_http_response(response, keep_alive),
+                               keep_alive))
+      try:
+        self.wakeup_w.send(b'\0')
+      except socket.error:
+        pass  # Bufor jest pełny, więc pętla zdarzeń i tak zostanie obudzona.
+
+  def __accept(self):
+    while True:
+      try:
+        c, c_addr = self.s.accept()
+      except socket.error as e:
+        # EAGAIN oznacza brak kolejnych połączeń. Inne błędy (np. EMFILE -
+        # limit otwartych plików) są przejściowe, ale gniazdo nasłuchujące
+        # pozostałoby gotowe do odczytu i pętla zdarzeń kręciłaby się w
+        # miejscu. Dlatego do najbliższego sprawdzenia bezczynnych połączeń
+        # (które może zwolnić deskryptory) gniazdo nie jest obserwowane, a
+        # połączenie czeka w kolejce.
+        if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+          if DEBUG:
+            sys.stdout.write("[WARNING] accept failed: %s\n" % e)
+          self.poller.modify(self.s, 0)
+          self.accept_paused = True
+        return
 
-  def __handle_client(self):
-    request = self.__recv_http_request()
-    if not request:
       if DEBUG:
-        sys.stdout.write("[WARNING] Client %s:%i doesn't make any sense. "
-                         "Disconnecting.\n" % self.s_addr)
+        sys.stdout.write("[  INFO ] New connection: %s:%i\n" % c_addr)
+      c.setblocking(0)
+      conn = EventConnection(c, c_addr)
+      self.connections.add(conn)
+      self.poller.register(c, Poller.READ, conn)
+
+  def __on_read(self, conn):
+    try:
+      data = conn.s.recv(65536)
+    except socket.error as e:
+      if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      self.__close(conn)
       return
 
-    if DEBUG:
-      sys.stdout.write("[  INFO ] Client %s:%i requested %s\n" % (
-          self.s_addr[0], self.s_addr[1], request['query']))
-    response = self.website.handle_http_request(request)
-    self.__send_http_response(response)
+    conn.last_active = time.time()
+    conn.reader.feed(data)
+    self.__process(conn)
+
+  def __process(self, conn):
+    # Jeśli odebrano już całe kolejne zapytanie, przekaż je do puli wątków.
+    # Zapytania z jednego połączenia są obsługiwane po kolei, również gdy
+    # klient wysłał kilka naraz, nie czekając na odpowiedzi (pipelining) -
+    # dzięki temu odpowiedzi są wysyłane w tej samej kolejności. Kolejne
+    # zapytanie jest odczytywane dopiero po wysłaniu poprzedniej odpowiedzi.
+    if conn.busy or conn.closing or conn.outbuf:
+      return
 
-  def run(self):
-    self.s.settimeout(5)  # Operacje nie powinny zajmować dłużej niż 5 sekund.
     try:
-      self.__handle_client()
-    except socket.timeout as e:
+      request = conn.reader.next_request()
+    except HTTPRequestError as e:
       if DEBUG:
-        sys.stdout.write("[WARNING] Client %s:%i timed out. "
-                         "Disconnecting.\n" % self.s_addr)
-    self.s.shutdown(socket.SHUT_RDWR)
-    self.s.close()
-
+        sys.stdout.write("[WARNING] Client %s:%i sent an invalid request (%s). "
+                         "Disconnecting.\n" % (conn.s_addr + (e,)))
+      conn.closing = True
+      conn.outbuf += build_http_response({ 'status': e.status })
+      self.__on_write(conn)
+      return
 
-# Niezbyt szybka, ale wygodna funkcja odbierająca dane aż do napotkania
-# konkretnego ciągu znaków (który również jest zwracany).
-def recvuntil(sock, txt):
-  txt = list(txt)
-  if sys.version_info.major == 3:
-    txt = [bytes(ch, 'ascii') for ch in txt]
+    if request is None:
+      if conn.reader.eof:
+        conn.closing = True
+        self.__on_write(conn)
+      return
 
-  full_data = []
-  last_n_bytes = [None] * len(txt)
+    if DEBUG:
+      sys.stdout.write("[  INFO ] Client %s:%i requested %s\n" % (
+          conn.s_addr[0], conn.s_addr[1], request['query']))
 
-  # Do póki ostatnie N bajtów nie będzie równe poszukiwanym, odczytuj dane.
-  while last_n_bytes != txt:
-    next_byte = sock.recv(1)
-    if not next_byte:
-      return ''  # Połączenie zostało zerwane.
-    full_data.append(next_byte)
-    last_n_bytes.pop(0)
-    last_n_bytes.append(next_byte)
-
-  full_data = b''.join(full_data)
-  if sys.version_info.major == 3:
-    return str(full_data, 'utf-8')
-  return full_data
+    conn.served += 1
+    keep_alive = (conn.served < self.max_requests and
+                  wants_keep_alive(request, conn.reader))
+    conn.busy = True
+    self.__update_events(conn)
+    self.requests.put((conn, request, keep_alive))
 
+  def __collect_responses(self):
+    try:
+      while self.wakeup_r.recv(4096):
+        pass
+    except socket.error:
+      pass
 
-# Pomocnicza funkcja odbierająca dokładnie określoną liczbę bajtów.
-def recv_all(sock, n):
-  data = []
-  data_len = 0
-  while data_len != n:
-    data_latest = sock.recv(n - data_len)
-    if not data_latest:
-      return None
-    data.append(data_latest)
-    data_len += len(data_latest)
+    with self.responses_lock:
+      responses = self.responses
+      self.responses = []
 
-  data = b''.join(data)
+    for conn, data, keep_alive in responses:
+      if conn.closed:
+        continue
+      conn.busy = False
+      conn.closing = not keep_alive
+      conn.outbuf += data
+      conn.last_active = time.time()
+      self.__on_write(conn)
+
+  def __on_write(self, conn):
+    if conn.outbuf:
+      try:
+        sent = conn.s.send(conn.outbuf)
+      except socket.error as e:
+        if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+          self.__close(conn)
+          return
+        sent = 0
+      conn.outbuf = conn.outbuf[sent:]
+
+    if not conn.outbuf:
+      if conn.closing:
+        # Ostatnia odpowiedź została wysłana.
+        self.__close(conn)
+        return
+      # Klient mógł już wysłać kolejne zapytanie.
+      self.__process(conn)
+      if conn.closed:
+        return
+    self.__update_events(conn)
+
+  def __update_events(self, conn):
+    # Odczytuj dane tylko wtedy, gdy połączenie czeka na kolejne zapytanie,
+    # a zapisuj, gdy jest coś do wysłania (reszta odpowiedzi).
+    events = 0
+    if not (conn.busy or conn.closing or conn.outbuf or conn.reader.eof):
+      events |= Poller.READ
+    if conn.outbuf:
+      events |= Poller.WRITE
+    self.poller.modify(conn.s, events)
+
+  def __close(self, conn):
+    if conn.closed:
+      return
+    conn.closed = True
+    self.connections.discard(conn)
+    self.poller.unregister(conn.s)
+    try:
+      conn.s.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass  # Klient mógł się już rozłączyć.
+    conn.s.close()
+
+
+# Para połączonych ze sobą gniazd. Python 2 na Windows nie ma
+# socket.socketpair, więc w razie potrzeby para jest tworzona przez połączenie
+# TCP na adresie lokalnym.
+def socketpair():
+  if hasattr(socket, 'socketpair'):
+    return socket.socketpair()
+  listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  listener.bind(('127.0.0.1', 0))
+  listener.listen(1)
+  a = socket.create_connection(listener.getsockname())
+  b, b_addr = listener.accept()
+  listener.close()
+  return a, b
+
+
+def bytes_to_str(data):
   if sys.version_info.major == 3:
     return str(data, 'utf-8')
   return data
 
-# Pomocnicza funkcja odbierająca dane aż do rozłączenia.
-def recv_remaining(sock):
-  data = []
-  while True:
-    data_latest = sock.recv(4096)
-    if not data_latest:
-      data = b''.join(data)
-      if sys.version_info.major == 3:
-        return str(data, 'utf-8')
-      return data      
-    data.append(data_latest)
-
-
-def main():
-  the_end = Event()
-  website = SimpleChatWWW(the_end)
-
-  # Stwórz gniazdo nasłuchujące na porcie 8888 na wszystkich interfejsach.
-  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-  # W przypadku GNU/Linux należy wskazać, iż ten sam adres lokalny powinien być
-  # możliwy do wykorzystania od razu po zamknięciu gniazda. W innym wypadku
-  # adres będzie w stani„e kwarantanny” (TIME_WAIT) przez 60 sekund i w tym czasie
-  # ponowna próba powiązania z nim gniazda zakończy się błędem.
-  s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)    
-
-  s.bind(('0.0.0.0', 8888))
-  s.listen(32) # Liczba w nawiasie mówi o maksymalnej wielkości kolejki
-               # oczekujących połączeń. W tym wypadku połączenia będą odbierane
-               # na bieżąco, wiec kolejka może być niewielka. Typowe wartości
-               # to 128 (GNU/Linux) lub „kilkaset” (Windows).
 
+# Pierwotna wersja serwera - osobny wątek dla każdego połączenia.
+def serve_threads(website, s, the_end):
   # Ustaw timeout na gnieździe, tak by blokujące operacje wykonywane na nim
   # były przerywane co sekundę (dzięki temu kod będzie mógł sprawdzić, serwer
   # został wezwany do zakończenia pracy).
@@ -408,6 +832,35 @@ def main():
     ct.start()
 
 
+def main():
+  the_end = Event()
+  website = SimpleChatWWW(the_end)
+
+  # Stwórz gniazdo nasłuchujące na porcie 8888 na wszystkich interfejsach.
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+  # W przypadku GNU/Linux należy wskazać, iż ten sam adres lokalny powinien być
+  # możliwy do wykorzystania od razu po zamknięciu gniazda. W innym wypadku
+  # adres będzie w stani„e kwarantanny” (TIME_WAIT) przez 60 sekund i w tym czasie
+  # ponowna próba powiązania z nim gniazda zakończy się błędem.
+  s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)    
+
+  s.bind(('0.0.0.0', 8888))
+  s.listen(1024) # Liczba w nawiasie mówi o maksymalnej wielkości kolejki
+                 # oczekujących połączeń. Serwer obsługuje tysiące połączeń
+                 # naraz, więc przy nagłym napływie klientów (lub gdy
+                 # odbieranie połączeń jest wstrzymane - patrz
+                 # EventServer.__accept) kolejka powinna być duża. System
+                 # może ją dodatkowo ograniczyć (np. net.core.somaxconn w
+                 # GNU/Linux).
+
+  # Domyślnie połączenia obsługuje EventServer; z opcją --threads serwer
+  # tworzy osobny wątek dla każdego połączenia.
+  if '--threads' in sys.argv[1:]:
+    serve_threads(website, s, the_end)
+  else:
+    EventServer(website, s).serve(the_end)
+
+
 if __name__ == "__main__":
   main()
-